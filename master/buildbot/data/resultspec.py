@@ -16,6 +16,9 @@
 from __future__ import annotations
 
 import dataclasses
+import functools
+import itertools
+import operator
 from typing import TYPE_CHECKING
 
 import sqlalchemy as sa
@@ -36,18 +39,42 @@ class NotSupportedFieldTypeError(TypeError):
 
 
 def _data_getter(d, fld):
+    """
+    Return a function reading the field `fld` of items of the same type as
+    `d`. All the items of a collection have the same type, so this avoids
+    checking it for each of them.
+    """
     if isinstance(d, dict):
-        return d[fld]
+        return operator.itemgetter(fld)
     if dataclasses.is_dataclass(d):
-        try:
-            return getattr(d, fld)
-        except AttributeError as e:
-            # backward compatibility when only dict was allowed
-            raise KeyError(*e.args) from e
+        getter = operator.attrgetter(fld)
+
+        def get(d):
+            try:
+                return getter(d)
+            except AttributeError as e:
+                # backward compatibility when only dict was allowed
+                raise KeyError(*e.args) from e
+
+        return get
 
     raise NotSupportedFieldTypeError(d)
 
 
+def _sort_key(get):
+    """
+    Return a sort key function for the values returned by `get`, which
+    orders None before any other value like L{NoneComparator}, but only
+    relies on native tuple comparisons.
+    """
+
+    def key(d):
+        value = get(d)
+        return (value is not None, value)
+
+    return key
+
+
 class FieldBase:
     """
     This class implements a basic behavior
@@ -55,7 +82,7 @@ class FieldBase:
 
     """
 
-    __slots__ = ['field', 'op', 'values']
+    __slots__ = ['_predicate', 'field', 'op', 'values']
 
     singular_operators = {
         'eq': lambda d, v: d == v[0],
@@ -69,6 +96,19 @@ class FieldBase:
         'notin': lambda d, v: d not in v,
     }
 
+    # operators of singular_operators for comparisons, with the operands
+    # swapped: `d < v` is `v > d`
+    singular_reflected_operators = {
+        'eq': operator.eq,
+        'ne': operator.ne,
+        'lt': operator.gt,
+        'le': operator.ge,
+        'gt': operator.lt,
+        'ge': operator.le,
+        'in': operator.eq,
+        'notin': operator.ne,
+    }
+
     singular_operators_sql = {
         'eq': lambda d, v: d == v[0],
         'ne': lambda d, v: d != v[0],
@@ -106,6 +146,8 @@ class FieldBase:
         self.values = values
         # `str` is a Sequence as well...
         assert not isinstance(values, str)
+        # built by the first apply(), as many filters are only used in SQL
+        self._predicate = None
 
     def getOperator(self, sqlMode=False):
         v = self.values
@@ -122,17 +164,58 @@ class FieldBase:
             v = set(v)
         return ops[self.op]
 
-    def apply(self, data):
-        fld = self.field
+    def _getPredicate(self):
+        # bind the values to the operator once, so that checking a row is a
+        # single call on the value of its field
         v = self.values
+        op = self.op
+        if len(v) == 1:
+            v0 = next(iter(v))
+            if op in self.singular_reflected_operators:
+                # a partial of a builtin operator runs without any Python
+                # bytecode, unlike a lambda
+                return functools.partial(self.singular_reflected_operators[op], v0)
+            if op == 'contains':
+                return lambda d: v0 in d
+        elif op in ('eq', 'ne', 'in', 'notin'):
+            try:
+                vs = frozenset(v)
+            except TypeError:
+                vs = v
+
+            def is_in(d):
+                try:
+                    return d in vs
+                except TypeError:
+                    # unhashable field values, e.g. lists
+                    return d in v
+
+            if op in ('eq', 'in'):
+                return is_in
+            return lambda d: not is_in(d)
+        elif op == 'contains':
+            vs = set(v)
+            return lambda d: not vs.isdisjoint(d)
+
         f = self.getOperator()
-        return (d for d in data if f(_data_getter(d, fld), v))
+        return lambda d: f(d, v)
+
+    def apply(self, data):
+        data = iter(data)
+        first = next(data, None)
+        if first is None:
+            return data
+        get = _data_getter(first, self.field)
+        f = self._predicate
+        if f is None:
+            f = self._predicate = self._getPredicate()
+        return (d for d in itertools.chain((first,), data) if f(get(d)))
 
     def __repr__(self):
         return f"resultspec.{self.__class__.__name__}('{self.field}','{self.op}',{self.values})"
 
     def __eq__(self, b):
-        for i in self.__slots__:
+        for i in ('field', 'op', 'values'):
             if getattr(self, i) != getattr(b, i):
                 return False
         return True
@@ -164,15 +247,12 @@ class NoneComparator:
 
     def __init__(self, value):
         self.value = value
+        # None sorts first; the values themselves are only compared when
+        # neither is None
+        self._key = (value is not None, value)
 
     def __lt__(self, other):
-        if self.value is None and other.value is None:
-            return False
-        elif self.value is None:
-            return True
-        elif other.value is None:
-            return False
-        return self.value < other.value
+        return self._key < other._key
 
     def __eq__(self, other):
         return self.value == other.value
@@ -181,13 +261,7 @@ class NoneComparator:
         return self.value != other.value
 
     def __gt__(self, other):
-        if self.value is None and other.value is None:
-            return False
-        elif self.value is None:
-            return False
-        elif other.value is None:
-            return True
-        return self.value > other.value
+        return self._key > other._key
 
 
 class ReverseComparator:
@@ -448,47 +522,36 @@ class ResultSpec:
             if total is None:
                 total = len(data)
 
-            if self.order:
-
-                def keyFunc(elem, order=self.order):
-                    """
-                    Do a multi-level sort by passing in the keys
-                    to sort by.
-
-                    @param elem: each item in the list to sort.
-                    @param order: a list of keys to sort by, such as:
-                                ('lastName', 'firstName', 'age')
-                    @return: a key used by sorted(). This will be a
-                             list such as:
-                             [a['lastName', a['firstName'], a['age']]
-                    @rtype: a C{list}
-                    """
-                    compareKey = []
-                    for k in order:
-                        doReverse = False
-                        if k[0] == '-':
-                            # If we get a key '-lastName',
-                            # it means sort by 'lastName' in reverse.
-                            k = k[1:]
-                            doReverse = True
-                        val = NoneComparator(_data_getter(elem, k))
-                        if doReverse:
-                            val = ReverseComparator(val)
-                        compareKey.append(val)
-                    return compareKey
-
-                data.sort(key=keyFunc)
+            # there is nothing to sort with less than two items
+            if self.order and len(data) > 1:
+                # Do a multi-level sort, such as ('lastName', 'firstName'),
+                # by sorting on the last key first: sorts are stable, so each
+                # pass keeps the order given by the following keys for items
+                # that compare equal.
+                for k in reversed(self.order):
+                    doReverse = False
+                    if k[0] == '-':
+                        # If we get a key '-lastName',
+                        # it means sort by 'lastName' in reverse.
+                        k = k[1:]
+                        doReverse = True
+                    data.sort(key=_sort_key(_data_getter(data[0], k)), reverse=doReverse)
 
             # finally, slice out the limit/offset
             if self.offset is not None or self.limit is not None:
                 if offset is not None or limit is not None:
                     raise AssertionError("endpoint must clear offset/limit")
-                end = (self.offset or 0) + self.limit if self.limit is not None else None
-                data = data[self.offset : end]
+                start = self.offset or 0
+                end = start + self.limit if self.limit is not None else None
+                # ListResult makes a list of its values, so only copy the page
+                rv = base.ListResult(itertools.islice(data, start, end))
                 offset = self.offset
                 limit = self.limit
+            else:
+                # data is already a list of our own, no need to copy it again
+                rv = base.ListResult([])
+                rv.data = data
 
-            rv = base.ListResult(data)
             rv.offset = offset
             rv.total = total
             rv.limit = limit
@@ -15,19 +15,19 @@
 
 from __future__ import annotations
 
-import base64
 import binascii
+import hmac
 import os
 import types
 from typing import TYPE_CHECKING
 from typing import ClassVar
 
 from twisted.application import strports
-from twisted.conch import manhole
-from twisted.conch import telnet
-from twisted.conch.insults import insults
 from twisted.cred import checkers
+from twisted.cred import credentials
+from twisted.cred import error
 from twisted.cred import portal
+from twisted.internet import defer
 from twisted.internet import protocol
 from twisted.python import log
 from zope.interface import implementer  # requires Twisted-2.0 or later
@@ -50,7 +50,8 @@ except ImportError:
     SSHPublicKeyDatabase = None  # type: ignore
 
 
-# makeTelnetProtocol and _TelnetRealm are for the TelnetManhole
+# makeTelnetProtocol and _TelnetRealm are for the TelnetManhole. The interactive
+# twisted.conch modules are only imported once a client actually connects.
 
 
 class makeTelnetProtocol:
@@ -61,6 +62,8 @@ class makeTelnetProtocol:
         self.portal = portal
 
     def __call__(self):
+        from twisted.conch import telnet
+
         auth = telnet.AuthenticatingTelnetProtocol
         return telnet.TelnetTransport(auth, self.portal)
 
@@ -71,6 +74,10 @@ class _TelnetRealm:
         self.namespace_maker = namespace_maker
 
     def requestAvatar(self, avatarId, *interfaces):
+        from twisted.conch import manhole
+        from twisted.conch import telnet
+        from twisted.conch.insults import insults
+
         if telnet.ITelnetProtocol in interfaces:
             namespace = self.namespace_maker()
             p = telnet.TelnetBootstrapProtocol(
@@ -80,6 +87,26 @@ class _TelnetRealm:
         raise NotImplementedError()
 
 
+@implementer(checkers.ICredentialsChecker)
+class _SingleUserPasswordChecker:
+    """Check username/password credentials against a single user, whose
+    credentials are encoded to bytes once and compared in constant time."""
+
+    credentialInterfaces = (credentials.IUsernamePassword,)
+
+    def __init__(self, username, password):
+        self.username = unicode2bytes(username)
+        self.password = unicode2bytes(password)
+
+    def requestAvatarId(self, creds):
+        # evaluate both comparisons so that timing does not reveal which one failed
+        username_ok = hmac.compare_digest(creds.username, self.username)
+        password_ok = hmac.compare_digest(creds.password, self.password)
+        if username_ok and password_ok:
+            return defer.succeed(self.username)
+        return defer.fail(error.UnauthorizedLogin())
+
+
 class chainedProtocolFactory:
     # this curries the 'namespace' argument into a later call to
     # chainedProtocolFactory()
@@ -88,6 +115,9 @@ class chainedProtocolFactory:
         self.namespace = namespace
 
     def __call__(self):
+        from twisted.conch import manhole
+        from twisted.conch.insults import insults
+
         return insults.ServerProtocol(manhole.ColoredManhole, self.namespace)
 
 
@@ -108,19 +138,59 @@ if SSHPublicKeyDatabase is not None:
 
         def __init__(self, authorized_keys_file):
             self.authorized_keys_file = os.path.expanduser(authorized_keys_file)
+            # (mtime, size, key blobs) of the last parse of the keyfile
+            self._cache: tuple[float, int, frozenset[bytes]] | None = None
 
-        def checkKey(self, credentials):
+        def _getKeyBlobs(self):
+            st = os.stat(self.authorized_keys_file)
+            if self._cache is not None and self._cache[:2] == (st.st_mtime, st.st_size):
+                return self._cache[2]
+
+            blobs = set()
             with open(self.authorized_keys_file, "rb") as f:
-                for l in f.readlines():
+                for l in f:
                     l2 = l.split()
                     if len(l2) < 2:
                         continue
                     try:
-                        if base64.decodebytes(l2[1]) == credentials.blob:
-                            return 1
+                        blobs.add(binascii.a2b_base64(l2[1]))
                     except binascii.Error:
                         continue
-            return 0
+            self._cache = (st.st_mtime, st.st_size, frozenset(blobs))
+            return self._cache[2]
+
+        def checkKey(self, credentials):
+            return 1 if credentials.blob in self._getKeyBlobs() else 0
+
+
+# ssh_hostkey_dir -> (fingerprint of the directory contents, (publicKeys, privateKeys, primes))
+_hostkey_cache: dict[str, tuple[tuple, tuple]] = {}
+
+
+def _getHostKeys(ssh_hostkey_dir):
+    """Load the host keys and moduli from ssh_hostkey_dir, reusing the previously parsed
+    keys if no file in the directory has changed since then (e.g. on reconfig)."""
+    fingerprint = []
+    for name in sorted(os.listdir(ssh_hostkey_dir)):
+        st = os.stat(os.path.join(ssh_hostkey_dir, name))
+        fingerprint.append((name, st.st_mtime, st.st_size))
+    fingerprint = tuple(fingerprint)
+
+    cached = _hostkey_cache.get(ssh_hostkey_dir)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+
+    assert OpenSSHFactory is not None, "cryptography required for ssh mahole."
+    openSSHFactory = OpenSSHFactory()
+    openSSHFactory.dataRoot = ssh_hostkey_dir
+    openSSHFactory.moduliRoot = ssh_hostkey_dir
+    keys = (
+        openSSHFactory.getPublicKeys(),
+        openSSHFactory.getPrivateKeys(),
+        openSSHFactory.getPrimes(),
+    )
+    _hostkey_cache[ssh_hostkey_dir] = (fingerprint, keys)
+    return keys
 
 
 class _BaseManhole(service.AsyncMultiService):
@@ -174,6 +244,9 @@ class _BaseManhole(service.AsyncMultiService):
             return namespace
 
         def makeProtocol():
+            from twisted.conch import manhole
+            from twisted.conch.insults import insults
+
             namespace = makeNamespace()
             p = insults.ServerProtocol(manhole.ColoredManhole, namespace)
             return p
@@ -188,13 +261,7 @@ class _BaseManhole(service.AsyncMultiService):
             r.chainedProtocolFactory = makeProtocol
             p = portal.Portal(r, [self.checker])
             f = manhole_ssh.ConchFactory(p)
-            assert OpenSSHFactory is not None, "cryptography required for ssh mahole."
-            openSSHFactory = OpenSSHFactory()
-            openSSHFactory.dataRoot = self.ssh_hostkey_dir
-            openSSHFactory.moduliRoot = self.ssh_hostkey_dir
-            f.publicKeys = openSSHFactory.getPublicKeys()
-            f.privateKeys = openSSHFactory.getPrivateKeys()
-            f.primes = openSSHFactory.getPrimes()
+            f.publicKeys, f.privateKeys, f.primes = _getHostKeys(self.ssh_hostkey_dir)
         else:
             self.using_ssh = False
             r = _TelnetRealm(makeNamespace)
@@ -220,8 +287,7 @@ class TelnetManhole(_BaseManhole, ComparableMixin):
         self.username = username
         self.password = password
 
-        c = checkers.InMemoryUsernamePasswordDatabaseDontUse()
-        c.addUser(unicode2bytes(username), unicode2bytes(password))
+        c = _SingleUserPasswordChecker(username, password)
 
         super().__init__(port, c)
 
@@ -236,8 +302,7 @@ class PasswordManhole(_BaseManhole, ComparableMixin):
         self.password = password
         self.ssh_hostkey_dir = ssh_hostkey_dir
 
-        c = checkers.InMemoryUsernamePasswordDatabaseDontUse()
-        c.addUser(unicode2bytes(username), unicode2bytes(password))
+        c = _SingleUserPasswordChecker(username, password)
 
         super().__init__(port, c, ssh_hostkey_dir)
 
@@ -283,25 +348,66 @@ class ArbitraryCheckerManhole(_BaseManhole, ComparableMixin):
 # utility functions for the manhole
 
 
-def show(x):
-    """Display the data attributes of an object in a readable format"""
-    print(f"data attributes of {x!r}")
-    names = dir(x)
-    maxlen = max([0] + [len(n) for n in names])
+def _show_str(v, budget):
+    if len(v) > budget:
+        return repr(v[:budget]) + "..."
+    return v
+
+
+def _show_scalar(v, budget):
+    return str(v)
+
+
+def _show_container(v, budget):
+    return f"{v} ({len(v)} elements)"
+
+
+def _show_method(v, budget):
+    return None
+
+
+def _show_other(v, budget):
+    # handles subclasses of the types in _show_formatters
+    if isinstance(v, types.MethodType):
+        return None
+    if isinstance(v, str):
+        return _show_str(v, budget)
+    if isinstance(v, (int, type(None))):
+        return str(v)
+    if isinstance(v, (list, tuple, dict)):
+        return _show_container(v, budget)
+    return str(type(v))
+
+
+_show_formatters = {
+    types.MethodType: _show_method,
+    str: _show_str,
+    int: _show_scalar,
+    bool: _show_scalar,
+    type(None): _show_scalar,
+    list: _show_container,
+    tuple: _show_container,
+    dict: _show_container,
+}
+
+
+def _show_impl(x, names, maxlen):
+    budget = 80 - maxlen - 5
+    get_formatter = _show_formatters.get
+    lines = []
     for k in names:
         v = getattr(x, k)
-        if isinstance(v, types.MethodType):
-            continue
-        if k[:2] == '__' and k[-2:] == '__':
-            continue
-        if isinstance(v, str):
-            if len(v) > 80 - maxlen - 5:
-                v = repr(v[: 80 - maxlen - 5]) + "..."
-        elif isinstance(v, (int, type(None))):
-            v = str(v)
-        elif isinstance(v, (list, tuple, dict)):
-            v = f"{v} ({len(v)} elements)"
-        else:
-            v = str(type(v))
-        print(f"{k.ljust(maxlen)} : {v}")
+        v = get_formatter(type(v), _show_other)(v, budget)
+        if v is not None:
+            lines.append(f"{k.ljust(maxlen)} : {v}")
+    return lines
+
+
+def show(x):
+    """Display the data attributes of an object in a readable format"""
+    names = [n for n in dir(x) if not (n.startswith('__') and n.endswith('__'))]
+    maxlen = max((len(n) for n in names), default=0)
+    lines = [f"data attributes of {x!r}", *_show_impl(x, names, maxlen)]
+    # manhole output goes through the terminal protocol, so write it in one go
+    print("\n".join(lines))
     return x
@@ -449,6 +449,13 @@ class BotMaster(service.ReconfigurableServiceMixin, service.AsyncMultiService, L
     def remove_in_progress_buildrequest(self, brid):
         return self._starting_brid_to_cancel.pop(brid, None)
 
+    def add_in_progress_buildrequests(self, brids):
+        self._starting_brid_to_cancel.update(dict.fromkeys(brids, False))
+
+    def remove_in_progress_buildrequests(self, brids):
+        for brid in brids:
+            self._starting_brid_to_cancel.pop(brid, None)
+
     def maybe_cancel_in_progress_buildrequest(self, brid, reason):
         """
         Ensures that after this call any builds resulting from build request will be visible or
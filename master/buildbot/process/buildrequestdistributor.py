@@ -15,9 +15,10 @@
 
 from __future__ import annotations
 
-import copy
+import heapq
 import math
 import random
+from collections import deque
 from datetime import datetime
 from typing import TYPE_CHECKING
 
@@ -32,7 +33,6 @@ from buildbot.process.buildrequest import BuildRequest
 from buildbot.util import deferwaiter
 from buildbot.util import epoch2datetime
 from buildbot.util import service
-from buildbot.util.async_sort import async_sort
 from buildbot.util.twisted import async_to_deferred
 
 if TYPE_CHECKING:
@@ -61,7 +61,14 @@ class BuildChooserBase:
         self.bldr = bldr
         self.master = master
         self.breqCache = {}
-        self.unclaimedBrdicts = None
+        self.unclaimedBrdicts: list[dict] | None = None
+        # index of self.unclaimedBrdicts by buildrequestid
+        self._brdict_by_id = {}
+        # heap of (-priority, buildrequestid, brdict); entries whose brdict has
+        # been removed from self._brdict_by_id are dropped lazily
+        self._brdict_heap = []
+        # builderid -> builder name, as needed to build BuildRequestModel's
+        self._builder_name_cache: dict[int, str] = {}
 
     @defer.inlineCallbacks
     def chooseNextBuild(self):
@@ -88,13 +95,21 @@ class BuildChooserBase:
         # the self.unclaimedBrdicts to None before calling."""
         if self.unclaimedBrdicts is None:
             # TODO: use order of the DATA API
+            builderid = yield self.bldr.getBuilderId()
+            # all of these brdicts belong to our builder, so there is no need
+            # to look up its name for each of them
+            self._builder_name_cache[builderid] = self.bldr.name
             brdicts = yield self.master.data.get(
-                ('builders', (yield self.bldr.getBuilderId()), 'buildrequests'),
+                ('builders', builderid, 'buildrequests'),
                 [resultspec.Filter('claimed', 'eq', [False])],
             )
-            # sort by buildrequestid, so the first is the oldest
-            brdicts.sort(key=lambda brd: brd['buildrequestid'])
+            # sort by buildrequestid, so the first is the oldest. This also
+            # turns the data API ListResult into a plain list
+            brdicts = sorted(brdicts, key=lambda brd: brd['buildrequestid'])
             self.unclaimedBrdicts = brdicts
+            self._brdict_by_id = {brd['buildrequestid']: brd for brd in brdicts}
+            self._brdict_heap = [(-brd['priority'], brd['buildrequestid'], brd) for brd in brdicts]
+            heapq.heapify(self._brdict_heap)
         return self.unclaimedBrdicts
 
     @defer.inlineCallbacks
@@ -104,17 +119,20 @@ class BuildChooserBase:
 
         breq = self.breqCache.get(brdict['buildrequestid'])
         if not breq:
-            builder = yield self.master.data.get(
-                ('builders', brdict['builderid']), [resultspec.ResultSpec(fields=['name'])]
-            )
-            if not builder:
-                return None
+            buildername = self._builder_name_cache.get(brdict['builderid'])
+            if buildername is None:
+                builder = yield self.master.data.get(
+                    ('builders', brdict['builderid']), [resultspec.ResultSpec(fields=['name'])]
+                )
+                if not builder:
+                    return None
+                buildername = self._builder_name_cache[brdict['builderid']] = builder['name']
 
             model = BuildRequestModel(
                 buildrequestid=brdict['buildrequestid'],
                 buildsetid=brdict['buildsetid'],
                 builderid=brdict['builderid'],
-                buildername=builder['name'],
+                buildername=buildername,
                 submitted_at=brdict['submitted_at'],
             )
             if 'complete_at' in brdict:
@@ -144,11 +162,7 @@ class BuildChooserBase:
         if breq is None:
             return None
 
-        brid = breq.id
-        for brdict in self.unclaimedBrdicts:
-            if brid == brdict['buildrequestid']:
-                return brdict
-        return None
+        return self._brdict_by_id.get(breq.id)
 
     def _removeBuildRequest(self, breq):
         # Remove a BuildrRequest object (and its brdict)
@@ -157,19 +171,76 @@ class BuildChooserBase:
         if breq is None:
             return
 
-        brdict = self._getBrdictForBuildRequest(breq)
+        brdict = self._brdict_by_id.pop(breq.id, None)
         if brdict is not None:
             self.unclaimedBrdicts.remove(brdict)
 
         if breq.id in self.breqCache:
             del self.breqCache[breq.id]
 
-    def _getUnclaimedBuildRequests(self):
-        # Retrieve the list of BuildRequest objects for all unclaimed builds
-        return defer.gatherResults(
-            [self._getBuildRequestForBrdict(brdict) for brdict in self.unclaimedBrdicts],
+    @defer.inlineCallbacks
+    def invalidate_claimed(self, brids, worker=None):
+        # Forget about build requests that turned out to be claimed by
+        # someone else, so that the chooser can keep going without
+        # refetching everything. A failed claim does not tell which of the
+        # brids were claimed, so the others are offered again.
+        # `worker` is the worker that was chosen for them, which is still free.
+        brdicts = yield defer.gatherResults(
+            [self.master.data.get(('buildrequests', brid)) for brid in brids],
             consumeErrors=True,
         )
+        for brid, brdict in zip(brids, brdicts):
+            if brdict is not None and not brdict['claimed']:
+                self._addBrdict(brdict)
+                continue
+            brdict = self._brdict_by_id.pop(brid, None)
+            if brdict is not None:
+                self.unclaimedBrdicts.remove(brdict)
+            self.breqCache.pop(brid, None)
+
+    def _addBrdict(self, brdict):
+        # Put an unclaimed brdict back into the cache, e.g. after it was
+        # chosen but could not be claimed along with other requests
+        brid = brdict['buildrequestid']
+        if self.unclaimedBrdicts is None or brid in self._brdict_by_id:
+            return
+        self.unclaimedBrdicts.append(brdict)
+        self.unclaimedBrdicts.sort(key=lambda brd: brd['buildrequestid'])
+        self._brdict_by_id[brid] = brdict
+        # the heap may still hold a stale entry for this brid, so rebuild it
+        self._brdict_heap = [
+            (-brd['priority'], brd['buildrequestid'], brd) for brd in self.unclaimedBrdicts
+        ]
+        heapq.heapify(self._brdict_heap)
+
+    def _getHighestPriorityBrdict(self):
+        # Return the unclaimed brdict with the highest priority, oldest first
+        # among equal priorities. This operates from the cache, which must be
+        # set up once via _fetchUnclaimedBrdicts
+        heap = self._brdict_heap
+        while heap and heap[0][1] not in self._brdict_by_id:
+            heapq.heappop(heap)
+        if not heap:
+            return None
+        return heap[0][2]
+
+    @async_to_deferred
+    async def _getUnclaimedBuildRequests(self) -> list[BuildRequest | None]:
+        # Retrieve the list of BuildRequest objects for all unclaimed builds.
+        # This is called once per build chosen, so only the requests that are
+        # not cached yet are converted
+        assert self.unclaimedBrdicts is not None
+        uncached = [
+            brdict
+            for brdict in self.unclaimedBrdicts
+            if brdict['buildrequestid'] not in self.breqCache
+        ]
+        if uncached:
+            await defer.gatherResults(
+                [self._getBuildRequestForBrdict(brdict) for brdict in uncached],
+                consumeErrors=True,
+            )
+        return [self.breqCache.get(brdict['buildrequestid']) for brdict in self.unclaimedBrdicts]
 
 
 class BasicBuildChooser(BuildChooserBase):
@@ -197,12 +268,12 @@ class BasicBuildChooser(BuildChooserBase):
         if not self.nextWorker:
             self.nextWorker = lambda _, workers, __: random.choice(workers) if workers else None
 
-        self.workerpool = self.bldr.getAvailableWorkers()
+        self._refillWorkerpool()
 
         # Pick workers one at a time from the pool, and if the Builder says
         # they're usable (eg, locks can be satisfied), then prefer those
         # workers.
-        self.preferredWorkers = []
+        self.preferredWorkers: deque = deque()
 
         self.nextBuild = self.bldr.config.nextBuild
 
@@ -217,7 +288,7 @@ class BasicBuildChooser(BuildChooserBase):
                 break
 
             if not self.workerpool and not self.preferredWorkers:
-                self.workerpool = self.bldr.getAvailableWorkers()
+                self._refillWorkerpool()
 
             #  2. pick a worker
             worker = yield self._popNextWorker(breq)
@@ -268,9 +339,7 @@ class BasicBuildChooser(BuildChooserBase):
                 nextBreq = None
         else:
             # otherwise just return the build with highest priority
-            brdict = sorted(self.unclaimedBrdicts.data, key=lambda b: b['priority'], reverse=True)[
-                0
-            ]
+            brdict = self._getHighestPriorityBrdict()
             nextBreq = yield self._getBuildRequestForBrdict(brdict)
 
         return nextBreq
@@ -279,7 +348,7 @@ class BasicBuildChooser(BuildChooserBase):
     def _popNextWorker(self, buildrequest):
         # use 'preferred' workers first, if we have some ready
         if self.preferredWorkers:
-            worker = self.preferredWorkers.pop(0)
+            worker = self.preferredWorkers.popleft()
             return worker
 
         while self.workerpool:
@@ -289,18 +358,33 @@ class BasicBuildChooser(BuildChooserBase):
                 log.err(Failure(), f"from nextWorker for builder '{self.bldr}'")
                 worker = None
 
-            if not worker or worker not in self.workerpool:
+            if not worker or worker not in self._workerpool_set:
                 # bad worker or no worker returned
                 break
 
             self.workerpool.remove(worker)
+            self._workerpool_set.discard(worker)
             return worker
 
         return None
 
+    @defer.inlineCallbacks
+    def invalidate_claimed(self, brids, worker=None):
+        yield super().invalidate_claimed(brids, worker)
+        if worker is not None:
+            # the worker could not start anything, offer it for the next build
+            self._unpopWorkers([worker])
+        elif not self.workerpool and not self.preferredWorkers:
+            self._refillWorkerpool()
+
+    def _refillWorkerpool(self):
+        self.workerpool = self.bldr.getAvailableWorkers()
+        # mirror of self.workerpool for membership tests
+        self._workerpool_set = set(self.workerpool)
+
     def _unpopWorkers(self, workers):
         # push the workers back to the front
-        self.preferredWorkers[:0] = workers
+        self.preferredWorkers.extendleft(reversed(workers))
 
     def canStartBuild(self, worker, breq):
         return self.bldr.canStartBuild(worker, breq)
@@ -320,6 +404,15 @@ class BuildRequestDistributor(service.AsyncMultiService):
 
     BuildChooser = BasicBuildChooser
 
+    # how long (in seconds) the default sorter may reuse the sort key of a
+    # builder whose build requests did not change in the meantime
+    SORT_KEY_CACHE_TTL = 1
+    # maximum number of builders whose sort keys are fetched at the same time
+    SORT_KEY_MAX_PARALLEL = 10
+    # number of claim conflicts on a builder after which the build chooser is
+    # recreated, rather than just forgetting about the conflicting requests
+    MAX_CLAIM_CONFLICTS = 3
+
     def __init__(self, botmaster):
         super().__init__()
         self.botmaster = botmaster
@@ -329,10 +422,17 @@ class BuildRequestDistributor(service.AsyncMultiService):
 
         # sorted list of names of builders that need their maybeStartBuild
         # method invoked.
-        self._pending_builders = []
+        self._pending_builders: deque[str] = deque()
+        # names of builders waiting for the next sort into _pending_builders.
+        # Calls that arrive while a sort is in progress accumulate here, so
+        # that a single pass sorts them all.
+        self._queued_builders: set[str] = set()
         self.activity_lock = defer.DeferredLock()
         self.active = False
 
+        # builder name -> (time computed, sort key) for _defaultSorter
+        self._sort_key_cache: dict[str, tuple[float, tuple]] = {}
+
         self._deferwaiter = deferwaiter.DeferWaiter()
         self._activity_loop_deferred = None
 
@@ -380,23 +480,29 @@ class BuildRequestDistributor(service.AsyncMultiService):
     @async_to_deferred
     async def _maybeStartBuildsOn(self, new_builders: list[str]) -> None:
         new_builder_set = set(new_builders)
-        existing_pending = set(self._pending_builders)
 
         # if we won't add any builders, there's nothing to do
-        if new_builder_set < existing_pending:
+        if new_builder_set <= self._queued_builders.union(self._pending_builders):
             return
 
+        self._queued_builders |= new_builder_set
+        # these builders are given a new chance because their requests may
+        # have changed, so their cached sort keys can't be trusted
+        for name in new_builder_set:
+            self._sort_key_cache.pop(name, None)
+
         # reset the list of pending builders
         try:
             async with self.pending_builders_lock:
-                # re-fetch existing_pending, in case it has changed
-                # while acquiring the lock
-                existing_pending = set(self._pending_builders)
+                # a pass that got the lock before us may have sorted our
+                # builders already
+                if not self._queued_builders:
+                    return
+                new_builder_set = self._queued_builders
+                self._queued_builders = set()
 
                 # then sort the new, expanded set of builders
-                self._pending_builders = await self._sortBuilders(
-                    list(existing_pending | new_builder_set)
-                )
+                self._pending_builders = await self._addPendingBuilders(new_builder_set)
 
                 # start the activity loop, if we aren't already
                 # working on that.
@@ -405,11 +511,56 @@ class BuildRequestDistributor(service.AsyncMultiService):
         except Exception:  # pragma: no cover
             log.err(Failure(), f"while attempting to start builds on {self.name}")
 
+    @async_to_deferred
+    async def _addPendingBuilders(self, new_builder_set: set[str]) -> deque[str]:
+        # return the pending builders, extended by new_builder_set and sorted.
+        # Must be called with pending_builders_lock held
+        existing = [name for name in self._pending_builders if name not in new_builder_set]
+
+        # with the default sorter, the builders that are already pending are
+        # still in order, so as long as their sort keys are fresh only the new
+        # builders need to be sorted, and can then be merged in. The keys are
+        # taken before sorting, as concurrent calls may drop them meanwhile
+        if existing and not self.master.config.prioritizeBuilders:
+            now = self.master.reactor.seconds()
+            keys = {}
+            for name in existing:
+                cached = self._sort_key_cache.get(name)
+                if cached is None or now - cached[0] >= self.SORT_KEY_CACHE_TTL:
+                    break
+                keys[name] = cached[1]
+            else:
+                builders_dict = self.botmaster.builders
+                new_builders = [builders_dict[n] for n in new_builder_set if n in builders_dict]
+                try:
+                    new_builders = await self._defaultSorter(self.master, new_builders)
+                except Exception:
+                    log.err(Failure(), "prioritizing builders; order unspecified")
+                else:
+                    for bldr in new_builders:
+                        cached = self._sort_key_cache.get(bldr.name)
+                        if cached is None:
+                            # dropped while sorting, so sort everything again
+                            break
+                        keys[bldr.name] = cached[1]
+                    else:
+                        return deque(
+                            heapq.merge(
+                                existing,
+                                [b.name for b in new_builders],
+                                key=keys.__getitem__,
+                            )
+                        )
+
+        return deque(await self._sortBuilders(existing + list(new_builder_set)))
+
     @defer.inlineCallbacks
     def _defaultSorter(self, master, builders):
         timer = metrics.Timer("BuildRequestDistributor._defaultSorter()")
         timer.start()
 
+        now = self.master.reactor.seconds()
+
         @defer.inlineCallbacks
         def key(bldr):
             # Sort primarily highest priority of build requests
@@ -425,9 +576,33 @@ class BuildRequestDistributor(service.AsyncMultiService):
             else:
                 if isinstance(time, datetime):
                     time = time.timestamp()
-            return (-priority, time, bldr.name)
+            sort_key = (-priority, time, bldr.name)
+            self._sort_key_cache[bldr.name] = (now, sort_key)
+            return sort_key
+
+        # take the cached keys as they are, and fetch the others in parallel
+        # before doing a single synchronous sort
+        keys = {}
+        missing = []
+        for bldr in builders:
+            cached = self._sort_key_cache.get(bldr.name)
+            if cached is not None and now - cached[0] < self.SORT_KEY_CACHE_TTL:
+                keys[bldr.name] = cached[1]
+            else:
+                missing.append(bldr)
+
+        if missing:
+            sem = defer.DeferredSemaphore(self.SORT_KEY_MAX_PARALLEL)
+            try:
+                missing_keys = yield defer.gatherResults(
+                    [sem.run(key, bldr) for bldr in missing], consumeErrors=True
+                )
+            except defer.FirstError as e:
+                raise e.subFailure.value from e
+            for bldr, sort_key in zip(missing, missing_keys):
+                keys[bldr.name] = sort_key
 
-        yield async_sort(builders, key)
+        builders.sort(key=lambda bldr: keys[bldr.name])
 
         timer.stop()
         return builders
@@ -445,6 +620,11 @@ class BuildRequestDistributor(service.AsyncMultiService):
         # find a sorting function
         sorter = self.master.config.prioritizeBuilders
         if not sorter:
+            # there is nothing to sort for a single builder. Custom sorters
+            # are still called, as they are allowed to drop builders
+            if len(builders) <= 1:
+                timer.stop()
+                return [b.name for b in builders]
             sorter = self._defaultSorter
 
         # run it
@@ -462,7 +642,7 @@ class BuildRequestDistributor(service.AsyncMultiService):
     async def _activityLoop(self) -> None:
         self.active = True
 
-        pending_builders: list[Builder] = []
+        pending_builders: deque[str] = deque()
         while True:
             async with self.activity_lock:
                 if not self.can_distribute:
@@ -475,11 +655,12 @@ class BuildRequestDistributor(service.AsyncMultiService):
                         if not self._pending_builders:
                             break
                         # take that builder list, and run it until the end
-                        # we make a copy of it, as it could be modified meanwhile
-                        pending_builders = copy.copy(self._pending_builders)
-                        self._pending_builders = []
+                        # no copy is needed: pending_builders_lock is held, and the
+                        # attribute is rebound to a fresh deque right away
+                        pending_builders = self._pending_builders
+                        self._pending_builders = deque()
 
-                bldr_name = pending_builders.pop(0)
+                bldr_name = pending_builders.popleft()
 
                 # get the actual builder object
                 bldr = self.botmaster.builders.get(bldr_name)
@@ -492,9 +673,19 @@ class BuildRequestDistributor(service.AsyncMultiService):
         self.active = False
 
     async def _maybeStartBuildsOnBuilder(self, bldr: Builder) -> None:
+        # without an available worker no build can start, so don't bother
+        # fetching the unclaimed build requests
+        if not bldr.getAvailableWorkers():
+            return
+
         # create a chooser to give us our next builds
         # this object is temporary and will go away when we're done
         bc = self.createBuildChooser(bldr, self.master)
+        claim_conflicts = 0
+
+        # buildsetid -> whether the buildset has a parent, for
+        # distribute_only_waited_childs
+        buildset_has_parent: dict[int, bool] = {}
 
         while True:
             worker, breqs = await bc.chooseNextBuild()
@@ -508,17 +699,28 @@ class BuildRequestDistributor(service.AsyncMultiService):
                 buildset_ids = set(br.bsid for br in breqs if br.waited_for)
                 if not buildset_ids:
                     continue
-                # get buildsets if they have a parent
-                buildsets_data: list[dict] = await self.master.data.get(
-                    ('buildsets',),
-                    filters=[
-                        resultspec.Filter('bsid', 'in', buildset_ids),
-                        resultspec.Filter('parent_buildid', 'ne', [None]),
-                    ],
-                    fields=['bsid', 'parent_buildid'],
-                )
-                parented_buildset_ids = set(bs['bsid'] for bs in buildsets_data)
-                breqs = [br for br in breqs if br.bsid in parented_buildset_ids]
+                if not buildset_ids <= buildset_has_parent.keys():
+                    # look up all the waited for buildsets of this builder at
+                    # once, rather than once per chosen build
+                    buildset_ids.update(
+                        brdict['buildsetid']
+                        for brdict in bc.unclaimedBrdicts or []
+                        if brdict.get('waited_for')
+                    )
+                    buildset_ids -= buildset_has_parent.keys()
+                    # get buildsets if they have a parent
+                    buildsets_data: list[dict] = await self.master.data.get(
+                        ('buildsets',),
+                        filters=[
+                            resultspec.Filter('bsid', 'in', buildset_ids),
+                            resultspec.Filter('parent_buildid', 'ne', [None]),
+                        ],
+                        fields=['bsid', 'parent_buildid'],
+                    )
+                    parented_buildset_ids = set(bs['bsid'] for bs in buildsets_data)
+                    for bsid in buildset_ids:
+                        buildset_has_parent[bsid] = bsid in parented_buildset_ids
+                breqs = [br for br in breqs if buildset_has_parent.get(br.bsid)]
                 if not breqs:
                     continue
 
@@ -528,11 +730,20 @@ class BuildRequestDistributor(service.AsyncMultiService):
             claimed_at = epoch2datetime(claimed_at_epoch)
 
             self._add_in_progress_brids(brids)
+            assert bldr.name is not None
+            self._sort_key_cache.pop(bldr.name, None)
             if not (
                 await self.master.data.updates.claimBuildRequests(brids, claimed_at=claimed_at)
             ):
-                # some brids were already claimed, so start over
-                bc = self.createBuildChooser(bldr, self.master)
+                # some brids were already claimed, most likely by another
+                # master. Drop them from the chooser, unless its view of the
+                # build requests looks too stale, in which case start over
+                claim_conflicts += 1
+                if claim_conflicts >= self.MAX_CLAIM_CONFLICTS:
+                    claim_conflicts = 0
+                    bc = self.createBuildChooser(bldr, self.master)
+                else:
+                    await bc.invalidate_claimed(brids, worker)
                 continue
 
             buildStarted = await bldr.maybeStartBuild(worker, breqs)
@@ -545,12 +756,10 @@ class BuildRequestDistributor(service.AsyncMultiService):
                 self.botmaster.maybeStartBuildsForBuilder(self.name)
 
     def _add_in_progress_brids(self, brids):
-        for brid in brids:
-            self.master.botmaster.add_in_progress_buildrequest(brid)
+        self.master.botmaster.add_in_progress_buildrequests(brids)
 
     def _remove_in_progress_brids(self, brids):
-        for brid in brids:
-            self.master.botmaster.remove_in_progress_buildrequest(brid)
+        self.master.botmaster.remove_in_progress_buildrequests(brids)
 
     def createBuildChooser(self, bldr, master):
         # just instantiate the build chooser requested
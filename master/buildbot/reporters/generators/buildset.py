@@ -22,7 +22,6 @@ from twisted.internet import defer
 from zope.interface import implementer
 
 from buildbot import interfaces
-from buildbot.process.results import statusToString
 from buildbot.reporters import utils
 from buildbot.reporters.message import MessageFormatter
 
@@ -97,18 +96,26 @@ class BuildSetStatusGenerator(BuildStatusGeneratorMixin):
         extra_info = None
         users = set()
         results = buildset["results"]
-        for build in builds:
-            patches.extend(self._get_patches_for_build(build))
-
-            build_logs = yield self._get_logs_for_build(build)
-            logs.extend(build_logs)
 
+        @defer.inlineCallbacks
+        def get_build_message(build):
             blamelist = yield reporter.getResponsibleUsersForBuild(master, build['buildid'])
-            users.update(set(blamelist))
-
             buildmsg = yield formatter.format_message_for_build(
                 master, build, is_buildset=True, mode=self.mode, users=blamelist
             )
+            return blamelist, buildmsg
+
+        # the messages of the builds are independent, so produce them
+        # concurrently; they are merged below in the order of the builds
+        build_messages = yield defer.gatherResults(
+            [get_build_message(build) for build in builds], consumeErrors=True
+        )
+
+        for build, (blamelist, buildmsg) in zip(builds, build_messages):
+            patches.extend(self._get_patches_for_build(build))
+            logs.extend(self._get_logs_for_build(build))
+
+            users.update(blamelist)
 
             msgtype, ok = self._merge_msgtype(msgtype, buildmsg['type'])
             if not ok:
@@ -125,12 +132,7 @@ class BuildSetStatusGenerator(BuildStatusGeneratorMixin):
                 continue
 
         if subject is None and self.subject is not None:
-            subject = self.subject % {
-                'result': statusToString(results),
-                'projectName': master.config.title,
-                'title': master.config.title,
-                'builder': 'whole buildset',
-            }
+            subject = self._get_default_subject(master, results, 'whole buildset')
 
         return {
             'body': body,
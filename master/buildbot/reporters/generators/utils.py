@@ -76,6 +76,8 @@ class BuildStatusGeneratorMixin(util.ComparableMixin):
         self.subject = subject
         self.add_logs = add_logs
         self.add_patch = add_patch
+        # (results, title, builder name) -> formatted default subject
+        self._default_subjects = {}
 
     def check(self):
         self._verify_build_generator_mode(self.mode)
@@ -226,12 +228,7 @@ class BuildStatusGeneratorMixin(util.ComparableMixin):
 
         subject = buildmsg['subject']
         if subject is None and self.subject is not None:
-            subject = self.subject % {
-                'result': statusToString(results),
-                'projectName': master.config.title,
-                'title': master.config.title,
-                'builder': build['builder']['name'],
-            }
+            subject = self._get_default_subject(master, results, build['builder']['name'])
 
         return {
             'body': buildmsg['body'],
@@ -246,6 +243,21 @@ class BuildStatusGeneratorMixin(util.ComparableMixin):
             "extra_info": buildmsg["extra_info"],
         }
 
+    def _get_default_subject(self, master, results, builder_name):
+        # the subject only depends on a handful of values, so format it once
+        # for each combination of them
+        title = master.config.title
+        key = (results, title, builder_name)
+        subject = self._default_subjects.get(key)
+        if subject is None:
+            subject = self._default_subjects[key] = self.subject % {
+                'result': statusToString(results),
+                'projectName': title,
+                'title': title,
+                'builder': builder_name,
+            }
+        return subject
+
     def _get_logs_for_build(self, build):
         if 'steps' not in build:
             return []
@@ -26,7 +26,8 @@ from zope.interface import implementer
 from buildbot.interfaces import ITriggerableScheduler
 from buildbot.process.properties import Properties
 from buildbot.schedulers import base
-from buildbot.util import debounce
+from buildbot.util import deferwaiter
+from buildbot.util.twisted import async_to_deferred
 
 if TYPE_CHECKING:
     from collections.abc import Sequence
@@ -43,19 +44,22 @@ class Triggerable(base.ReconfigurableBaseScheduler):
         super().__init__(*args, name=name, builderNames=builderNames, **kwargs)
         self._waiters = {}
         self._buildset_complete_consumer = None
+        self._starting_consumer = False
+        self._consumer_waiter = deferwaiter.DeferWaiter()
 
     def checkConfig(self, builderNames, reason=None, **kwargs: Any):  # type: ignore[override]
         super().checkConfig(builderNames=builderNames, **kwargs)
 
-    @defer.inlineCallbacks
-    def reconfigService(  # type: ignore[override]
+    @async_to_deferred
+    async def reconfigService(  # type: ignore[override]
         self,
         builderNames,
         reason=None,
         **kwargs: Any,
     ):
-        yield super().reconfigService(builderNames=builderNames, **kwargs)
+        await super().reconfigService(builderNames=builderNames, **kwargs)
         self.reason = reason
+        self._default_reason = f"The Triggerable scheduler named '{self.name}' triggered this build"
 
     def trigger(
         self,
@@ -71,17 +75,20 @@ class Triggerable(base.ReconfigurableBaseScheduler):
             available.
             resultsDeferred -- yields the build result(s), when they finish."""
         # properties for this buildset are composed of our own properties,
-        # potentially overridden by anything from the triggering build
-        props = Properties()
-        props.updateFromProperties(self.properties)
+        # potentially overridden by anything from the triggering build. Without
+        # the latter, our own properties can be passed as they are, as
+        # addBuildsetForSourceStamps makes its own copy of them
+        props = self.properties
 
         reason = self.reason
         if set_props:
+            props = Properties()
+            props.updateFromProperties(self.properties)
             props.updateFromProperties(set_props)
             reason = set_props.getProperty('reason')
 
         if reason is None:
-            reason = f"The Triggerable scheduler named '{self.name}' triggered this build"
+            reason = self._default_reason
 
         # note that this does not use the buildset subscriptions mechanism, as
         # the duration of interest to the caller is bounded by the lifetime of
@@ -96,26 +103,38 @@ class Triggerable(base.ReconfigurableBaseScheduler):
             parent_relationship=parent_relationship,
         )
 
-        resultsDeferred = defer.Deferred()
+        def cancel_waiter(d):
+            # the caller is not interested in the results anymore, so don't
+            # keep the deferred around until the buildset completes
+            for bsid, (waiter_d, _) in list(self._waiters.items()):
+                if waiter_d is d:
+                    del self._waiters[bsid]
+                    if not self._waiters:
+                        self._maybe_stop_consuming()
+                    break
+
+        resultsDeferred = defer.Deferred(canceller=cancel_waiter)
 
         @idsDeferred.addCallback
         def setup_waiter(ids):
+            if resultsDeferred.called:
+                # cancelled before the buildset was even added
+                return ids
             bsid, brids = ids
             self._waiters[bsid] = (resultsDeferred, brids)
-            self._updateWaiters()
+            if self._buildset_complete_consumer:
+                self._consumer_waiter.add(self._check_buildset_complete(bsid))
+            else:
+                # the waiters are checked once subscribed
+                self._maybe_start_consuming()
             return ids
 
         return idsDeferred, resultsDeferred
 
-    @defer.inlineCallbacks
-    def startService(self):
-        yield super().startService()
-        self._updateWaiters.start()
-
-    @defer.inlineCallbacks
-    def stopService(self):
-        # finish any _updateWaiters calls
-        yield self._updateWaiters.stop()
+    @async_to_deferred
+    async def stopService(self) -> None:
+        # finish setting up the subscription, if that is in progress
+        await self._consumer_waiter.wait()
 
         # cancel any outstanding subscription
         if self._buildset_complete_consumer:
@@ -125,32 +144,61 @@ class Triggerable(base.ReconfigurableBaseScheduler):
         # and errback any outstanding deferreds
         if self._waiters:
             msg = 'Triggerable scheduler stopped before build was complete'
+            # the same failure can be given to all the waiters
+            f = failure.Failure(RuntimeError(msg))
             for d, _ in self._waiters.values():
-                d.errback(failure.Failure(RuntimeError(msg)))
+                d.errback(f)
             self._waiters = {}
 
-        yield super().stopService()
+        await super().stopService()
 
-    @debounce.method(wait=0)
-    @defer.inlineCallbacks
-    def _updateWaiters(self):
-        if self._waiters and not self._buildset_complete_consumer:
-            startConsuming = self.master.mq.startConsuming
-            self._buildset_complete_consumer = yield startConsuming(
+    # the subscription to buildset completion notifications only needs to
+    # change when _waiters goes from empty to non-empty, or back
+
+    def _maybe_start_consuming(self):
+        if self._buildset_complete_consumer or self._starting_consumer:
+            return
+        self._consumer_waiter.add(self._start_consuming())
+
+    @async_to_deferred
+    async def _start_consuming(self) -> None:
+        self._starting_consumer = True
+        try:
+            self._buildset_complete_consumer = await self.master.mq.startConsuming(
                 self._buildset_complete_cb, ('buildsets', None, 'complete')
             )
-        elif not self._waiters and self._buildset_complete_consumer:
+        finally:
+            self._starting_consumer = False
+        # the waiters may have gone away while subscribing
+        self._maybe_stop_consuming()
+        if self._buildset_complete_consumer:
+            for bsid in list(self._waiters):
+                self._consumer_waiter.add(self._check_buildset_complete(bsid))
+
+    @async_to_deferred
+    async def _check_buildset_complete(self, bsid: int) -> None:
+        # the buildset may have completed before we were subscribed to
+        # buildset completion notifications, or before its waiter was set up,
+        # in which case no notification is coming for it anymore
+        buildset = await self.master.data.get(('buildsets', bsid))
+        if buildset and buildset['complete']:
+            self._buildset_complete_cb(None, {'bsid': bsid, 'results': buildset['results']})
+
+    def _maybe_stop_consuming(self):
+        if not self._waiters and self._buildset_complete_consumer:
             self._buildset_complete_consumer.stopConsuming()
             self._buildset_complete_consumer = None
 
     def _buildset_complete_cb(self, key, msg):
-        if msg['bsid'] not in self._waiters:
+        # pop this bsid from the waiters list, if we are waiting for it,
+        waiter = self._waiters.pop(msg['bsid'], None)
+        if waiter is None:
             return
-
-        # pop this bsid from the waiters list,
-        d, brids = self._waiters.pop(msg['bsid'])
-        # ..and potentially stop consuming buildset completion notifications
-        self._updateWaiters()
+        d, brids = waiter
+        # ..and stop consuming buildset completion notifications if that was
+        # the last one
+        if not self._waiters:
+            self._maybe_stop_consuming()
 
         # fire the callback to indicate that the triggered build is complete
         d.callback((msg['results'], brids))
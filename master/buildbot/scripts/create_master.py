@@ -13,6 +13,7 @@
 #
 # Copyright Buildbot Team Members
 
+import functools
 import os
 
 import jinja2
@@ -34,12 +35,18 @@ def makeBasedir(config):
     os.mkdir(config['basedir'])
 
 
-def makeTAC(config):
-    # render buildbot_tac.tmpl using the config
+@functools.lru_cache(1)
+def _get_tac_template():
+    # the template does not depend on the config, so only compile it once
     loader = jinja2.FileSystemLoader(os.path.dirname(__file__))
     env = jinja2.Environment(loader=loader, undefined=jinja2.StrictUndefined)
     env.filters['repr'] = repr
-    tpl = env.get_template('buildbot_tac.tmpl')
+    return env.get_template('buildbot_tac.tmpl')
+
+
+def makeTAC(config):
+    # render buildbot_tac.tmpl using the config
+    tpl = _get_tac_template()
     cxt = dict((k.replace('-', '_'), v) for k, v in config.items())
     contents = tpl.render(cxt)
 
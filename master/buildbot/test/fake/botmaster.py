@@ -54,6 +54,13 @@ class FakeBotMaster(service.AsyncMultiService, botmaster.LockRetrieverMixin):
     def remove_in_progress_buildrequest(self, brid):
         return self._starting_brid_to_cancel.pop(brid, None)
 
+    def add_in_progress_buildrequests(self, brids):
+        self._starting_brid_to_cancel.update(dict.fromkeys(brids, False))
+
+    def remove_in_progress_buildrequests(self, brids):
+        for brid in brids:
+            self._starting_brid_to_cancel.pop(brid, None)
+
     def maybe_cancel_in_progress_buildrequest(self, brid, reason):
         if brid in self._starting_brid_to_cancel:
             self._starting_brid_to_cancel[brid] = reason
@@ -237,3 +237,13 @@ class TestBotMaster(TestReactorMixin, unittest.TestCase):
         self.botmaster.maybeStartBuildsForAllBuilders()
 
         brd.maybeStartBuildsOn.assert_called_once_with(['frank', 'larry'])
+
+    def test_in_progress_buildrequests(self):
+        self.botmaster.add_in_progress_buildrequests([10, 11, 12])
+        self.botmaster.maybe_cancel_in_progress_buildrequest(11, 'no reason')
+
+        self.assertEqual(self.botmaster.remove_in_progress_buildrequest(10), False)
+        self.assertEqual(self.botmaster.remove_in_progress_buildrequest(11), 'no reason')
+
+        self.botmaster.remove_in_progress_buildrequests([12, 13])
+        self.assertIsNone(self.botmaster.remove_in_progress_buildrequest(12))
@@ -14,6 +14,7 @@
 # Copyright Buildbot Team Members
 
 import random
+from collections import deque
 from unittest import mock
 
 from parameterized import parameterized
@@ -224,6 +225,31 @@ class Test(TestBRDBase):
         self.assertEqual(self.maybeStartBuildsOnBuilder_calls, builders)
         self.checkAllCleanedUp()
 
+    @defer.inlineCallbacks
+    def test_maybeStartBuildsOn_coalesces_while_sorting(self):
+        builders = [f'bldr{i:02}' for i in range(5)]
+        sorted_lists = []
+
+        def slow_sorter(master, bldrs):
+            bldrs.sort(key=lambda b1: b1.name)
+            sorted_lists.append([b.name for b in bldrs])
+            d = defer.Deferred()
+            self.reactor.callLater(0, d.callback, bldrs)
+            return d
+
+        self.master.config.prioritizeBuilders = slow_sorter
+
+        self.useMock_maybeStartBuildsOnBuilder()
+        self.addBuilders(builders)
+        # the calls arriving while the first sort is in progress are sorted
+        # together in a single pass
+        yield defer.gatherResults([self.brd.maybeStartBuildsOn([bldr]) for bldr in builders])
+
+        yield self.brd._waitForFinish()
+        self.assertEqual(sorted_lists, [builders[:1], builders])
+        self.assertEqual(self.maybeStartBuildsOnBuilder_calls, builders)
+        self.checkAllCleanedUp()
+
     @defer.inlineCallbacks
     def test_maybeStartBuildsOn_exception(self):
         self.addBuilders(['bldr1'])
@@ -336,6 +362,127 @@ class Test(TestBRDBase):
             ['bldr1', 'bldr3', 'bldr2'],
         )
 
+    @defer.inlineCallbacks
+    def test_sortBuilders_default_single(self):
+        self.useMock_maybeStartBuildsOnBuilder()
+        self.addBuilders(['bldr1'])
+        self.builders['bldr1'].getOldestRequestTime = mock.Mock()
+
+        result = yield self.brd._sortBuilders(['bldr1'])
+
+        self.assertEqual(result, ['bldr1'])
+        self.builders['bldr1'].getOldestRequestTime.assert_not_called()
+        self.checkAllCleanedUp()
+
+    @defer.inlineCallbacks
+    def test_sortBuilders_default_caches_keys(self):
+        self.addBuilders(['bldr1', 'bldr2'])
+        self.master.config.prioritizeBuilders = None
+        for bldr in self.builders.values():
+            bldr.get_highest_priority = mock.Mock(return_value=10)
+            bldr.getOldestRequestTime = mock.Mock(return_value=None)
+
+        def assert_key_computations(bldr1, bldr2):
+            self.assertEqual(self.builders['bldr1'].get_highest_priority.call_count, bldr1)
+            self.assertEqual(self.builders['bldr2'].get_highest_priority.call_count, bldr2)
+
+        yield self.brd._sortBuilders(['bldr1', 'bldr2'])
+        assert_key_computations(1, 1)
+
+        # keys are reused for a short while
+        self.builders['bldr2'].get_highest_priority.return_value = 20
+        result = yield self.brd._sortBuilders(['bldr1', 'bldr2'])
+        self.assertEqual(result, ['bldr1', 'bldr2'])
+        assert_key_computations(1, 1)
+
+        # but not for builders given a new chance to start builds
+        self.useMock_maybeStartBuildsOnBuilder()
+        yield self.brd.maybeStartBuildsOn(['bldr2'])
+        yield self.brd._waitForFinish()
+        # (a single builder does not need sorting)
+        assert_key_computations(1, 1)
+        result = yield self.brd._sortBuilders(['bldr1', 'bldr2'])
+        self.assertEqual(result, ['bldr2', 'bldr1'])
+        assert_key_computations(1, 2)
+
+        # and not once they are too old
+        self.reactor.advance(self.brd.SORT_KEY_CACHE_TTL)
+        yield self.brd._sortBuilders(['bldr1', 'bldr2'])
+        assert_key_computations(2, 3)
+
+    @defer.inlineCallbacks
+    def test_addPendingBuilders_merges(self):
+        self.addBuilders(['bldr1', 'bldr2', 'bldr3', 'bldr4'])
+        self.master.config.prioritizeBuilders = None
+        for bldr, priority in zip(self.builders.values(), [40, 10, 30, 20]):
+            bldr.get_highest_priority = mock.Mock(return_value=priority)
+            bldr.getOldestRequestTime = mock.Mock(return_value=None)
+
+        self.brd._pending_builders = deque(
+            (yield self.brd._sortBuilders(['bldr1', 'bldr2', 'bldr3']))
+        )
+        self.assertEqual(list(self.brd._pending_builders), ['bldr1', 'bldr3', 'bldr2'])
+
+        # bldr3 is given a new chance, with a new priority
+        del self.brd._sort_key_cache['bldr3']
+        self.builders['bldr3'].get_highest_priority.return_value = 5
+        result = yield self.brd._addPendingBuilders({'bldr3', 'bldr4'})
+
+        self.assertEqual(list(result), ['bldr1', 'bldr4', 'bldr2', 'bldr3'])
+        # the keys of the builders that were already pending were not fetched again
+        self.assertEqual(self.builders['bldr1'].get_highest_priority.call_count, 1)
+        self.assertEqual(self.builders['bldr2'].get_highest_priority.call_count, 1)
+
+    @defer.inlineCallbacks
+    def test_addPendingBuilders_stale_keys(self):
+        self.addBuilders(['bldr1', 'bldr2', 'bldr3'])
+        self.master.config.prioritizeBuilders = None
+        for bldr, priority in zip(self.builders.values(), [10, 30, 20]):
+            bldr.get_highest_priority = mock.Mock(return_value=priority)
+            bldr.getOldestRequestTime = mock.Mock(return_value=None)
+
+        self.brd._pending_builders = deque((yield self.brd._sortBuilders(['bldr1', 'bldr2'])))
+        self.assertEqual(list(self.brd._pending_builders), ['bldr2', 'bldr1'])
+
+        # the pending builders are sorted again once their keys are too old
+        self.builders['bldr1'].get_highest_priority.return_value = 40
+        self.reactor.advance(self.brd.SORT_KEY_CACHE_TTL)
+        result = yield self.brd._addPendingBuilders({'bldr3'})
+
+        self.assertEqual(list(result), ['bldr1', 'bldr2', 'bldr3'])
+        self.assertEqual(self.builders['bldr1'].get_highest_priority.call_count, 2)
+
+    @defer.inlineCallbacks
+    def test_addPendingBuilders_key_dropped_while_sorting(self):
+        self.addBuilders(['bldr1', 'bldr2', 'bldr3', 'bldr4'])
+        self.master.config.prioritizeBuilders = None
+        for bldr, priority in zip(self.builders.values(), [40, 10, 30, 20]):
+            bldr.get_highest_priority = mock.Mock(return_value=priority)
+            bldr.getOldestRequestTime = mock.Mock(return_value=None)
+
+        self.brd._pending_builders = deque((yield self.brd._sortBuilders(['bldr1', 'bldr2'])))
+
+        # block the sort of bldr3
+        blocked = defer.Deferred()
+        self.builders['bldr3'].get_highest_priority.return_value = blocked
+
+        self.useMock_maybeStartBuildsOnBuilder()
+        d1 = self.brd.maybeStartBuildsOn(['bldr3'])
+        # bldr1 is pending, and is given a new chance while bldr3 is sorted
+        d2 = self.brd.maybeStartBuildsOn(['bldr1', 'bldr4'])
+        self.assertNotIn('bldr1', self.brd._sort_key_cache)
+
+        blocked.callback(30)
+        yield d1
+        yield d2
+        yield self.brd._waitForFinish()
+
+        self.assertEqual(
+            sorted(self.maybeStartBuildsOnBuilder_calls), ['bldr1', 'bldr2', 'bldr3', 'bldr4']
+        )
+        self.assertEqual(self.flushLoggedErrors(), [])
+        self.checkAllCleanedUp()
+
     def test_sortBuilders_custom(self):
         def prioritizeBuilders(master, builders):
             self.assertIdentical(master, self.master)
@@ -454,6 +601,14 @@ class TestMaybeStartBuilds(TestBRDBase):
         ]
         yield self.do_test_maybeStartBuildsOnBuilder(rows=rows, exp_claims=[], exp_builds=[])
 
+    @defer.inlineCallbacks
+    def test_no_available_workers(self):
+        self.addWorkers({'test-worker1': 0})
+        rows = [*self.base_rows, fakedb.BuildRequest(id=10, buildsetid=11, builderid=77)]
+        self.brd.createBuildChooser = mock.Mock()
+        yield self.do_test_maybeStartBuildsOnBuilder(rows=rows, exp_claims=[], exp_builds=[])
+        self.brd.createBuildChooser.assert_not_called()
+
     @defer.inlineCallbacks
     def test_limited_by_workers(self):
         self.addWorkers({'test-worker1': 1})
@@ -623,6 +778,59 @@ class TestMaybeStartBuilds(TestBRDBase):
             exp_builds=[('test-worker2', [10]), ('test-worker1', [11])],
         )
 
+    @defer.inlineCallbacks
+    def test_sorted_by_priority(self):
+        self.bldr.config.nextWorker = nth_worker(0)
+        self.addWorkers({'test-worker1': 1, 'test-worker2': 1, 'test-worker3': 1})
+        rows = [
+            *self.base_rows,
+            fakedb.BuildRequest(id=10, buildsetid=11, builderid=77, priority=0),
+            fakedb.BuildRequest(id=11, buildsetid=11, builderid=77, priority=5),
+            fakedb.BuildRequest(id=12, buildsetid=11, builderid=77, priority=10),
+            fakedb.BuildRequest(id=13, buildsetid=11, builderid=77, priority=5),
+        ]
+        yield self.do_test_maybeStartBuildsOnBuilder(
+            rows=rows,
+            exp_claims=[11, 12, 13],
+            exp_builds=[
+                ('test-worker1', [12]),
+                ('test-worker2', [11]),
+                ('test-worker3', [13]),
+            ],
+        )
+
+    @defer.inlineCallbacks
+    def test_distribute_only_waited_childs(self):
+        self.brd.distribute_only_waited_childs = True
+        self.bldr.config.nextWorker = nth_worker(0)
+        self.addWorkers({'test-worker1': 1, 'test-worker2': 1, 'test-worker3': 1})
+        rows = [
+            *self.base_rows,
+            fakedb.Worker(id=1, name='w'),
+            fakedb.Build(id=50, buildrequestid=9, builderid=77, workerid=1, masterid=88),
+            fakedb.BuildRequest(id=9, buildsetid=11, builderid=77, complete=1),
+            fakedb.Buildset(id=12, parent_buildid=50),
+            fakedb.BuildsetSourceStamp(sourcestampid=21, buildsetid=12),
+            fakedb.Buildset(id=13, parent_buildid=50),
+            fakedb.BuildsetSourceStamp(sourcestampid=21, buildsetid=13),
+            fakedb.BuildRequest(id=10, buildsetid=11, builderid=77, waited_for=1),
+            fakedb.BuildRequest(id=11, buildsetid=12, builderid=77, waited_for=1),
+            fakedb.BuildRequest(id=12, buildsetid=12, builderid=77),
+            fakedb.BuildRequest(id=13, buildsetid=13, builderid=77, waited_for=1),
+        ]
+        get = self.master.data.get
+        self.master.data.get = mock.Mock(side_effect=get)
+
+        yield self.do_test_maybeStartBuildsOnBuilder(
+            rows=rows,
+            exp_claims=[11, 13],
+            exp_builds=[('test-worker2', [11]), ('test-worker1', [13])],
+        )
+        buildsets_gets = [
+            c for c in self.master.data.get.call_args_list if c.args[0] == ('buildsets',)
+        ]
+        self.assertEqual(len(buildsets_gets), 1)
+
     @defer.inlineCallbacks
     def test_bldr_maybeStartBuild_fails_always(self):
         self.bldr.config.nextWorker = nth_worker(-1)
@@ -767,6 +975,73 @@ class TestMaybeStartBuilds(TestBRDBase):
             rows=rows, exp_claims=[11], exp_builds=[('test-worker1', [11])]
         )
 
+    @defer.inlineCallbacks
+    def test_claim_race_keeps_chooser(self):
+        self.bldr.config.nextWorker = nth_worker(0)
+        old_claimBuildRequests = self.master.db.buildrequests.claimBuildRequests
+
+        def claimBuildRequests(brids, claimed_at=None):
+            self.master.db.buildrequests.claimBuildRequests = old_claimBuildRequests
+            self.master.db.buildrequests._claim_buildrequests_for_master([10], 136000, 9999)
+            return defer.fail(buildrequests.AlreadyClaimedError())
+
+        self.master.db.buildrequests.claimBuildRequests = claimBuildRequests
+
+        createBuildChooser = self.brd.createBuildChooser
+        self.brd.createBuildChooser = mock.Mock(side_effect=createBuildChooser)
+
+        self.addWorkers({'test-worker1': 1})
+        rows = [
+            *self.base_rows,
+            fakedb.Master(id=9999),
+            fakedb.BuildRequest(id=10, buildsetid=11, builderid=77, submitted_at=130000),
+            fakedb.BuildRequest(id=11, buildsetid=11, builderid=77, submitted_at=135000),
+        ]
+        yield self.do_test_maybeStartBuildsOnBuilder(
+            rows=rows, exp_claims=[11], exp_builds=[('test-worker1', [11])]
+        )
+        # the chooser survived the conflict, and its only worker was reused
+        self.assertEqual(self.brd.createBuildChooser.call_count, 1)
+
+    @defer.inlineCallbacks
+    def test_claim_race_collapsed(self):
+        class CollapsingBuildChooser(buildrequestdistributor.BasicBuildChooser):
+            # builds all unclaimed requests at once
+            @defer.inlineCallbacks
+            def chooseNextBuild(self):
+                worker, breq = yield self.popNextBuild()
+                if not worker or not breq:
+                    return (None, None)
+                breqs = [breq]
+                for other in (yield self._getUnclaimedBuildRequests()):
+                    self._removeBuildRequest(other)
+                    breqs.append(other)
+                return (worker, breqs)
+
+        self.brd.BuildChooser = CollapsingBuildChooser
+        old_claimBuildRequests = self.master.db.buildrequests.claimBuildRequests
+
+        def claimBuildRequests(brids, claimed_at=None):
+            # only brid 11 is claimed by another master
+            self.master.db.buildrequests.claimBuildRequests = old_claimBuildRequests
+            self.master.db.buildrequests._claim_buildrequests_for_master([11], 136000, 9999)
+            return defer.fail(buildrequests.AlreadyClaimedError())
+
+        self.master.db.buildrequests.claimBuildRequests = claimBuildRequests
+
+        self.addWorkers({'test-worker1': 1})
+        rows = [
+            *self.base_rows,
+            fakedb.Master(id=9999),
+            fakedb.BuildRequest(id=10, buildsetid=11, builderid=77, submitted_at=130000),
+            fakedb.BuildRequest(id=11, buildsetid=11, builderid=77, submitted_at=135000),
+            fakedb.BuildRequest(id=12, buildsetid=11, builderid=77, submitted_at=136000),
+        ]
+        # the requests that are still unclaimed are built in the same pass
+        yield self.do_test_maybeStartBuildsOnBuilder(
+            rows=rows, exp_claims=[10, 12], exp_builds=[('test-worker1', [10, 12])]
+        )
+
     # nextWorker
     @defer.inlineCallbacks
     def do_test_nextWorker(self, nextWorker, global_select_next_worker, exp_choice=None):
@@ -345,6 +345,56 @@ class Triggerable(scheduler.SchedulerMixin, TestReactorMixin, unittest.TestCase)
             [q.filter for q in sched.master.mq.qrefs], [('schedulers', '13', 'updated')]
         )
 
+    @defer.inlineCallbacks
+    def test_trigger_cancelled(self):
+        sched = yield self.makeScheduler()
+        yield self.master.startService()
+
+        idsDeferred, d = sched.trigger(False)
+        bsid, _ = yield idsDeferred
+        self.assertEqual(list(sched._waiters), [bsid])
+        self.assertEqual(
+            [q.filter for q in sched.master.mq.qrefs],
+            [('schedulers', '13', 'updated'), ('buildsets', None, 'complete')],
+        )
+
+        d.cancel()
+        with self.assertRaises(defer.CancelledError):
+            yield d
+
+        # the waiter is forgotten, and the subscription dropped
+        self.assertEqual(sched._waiters, {})
+        self.assertEqual(
+            [q.filter for q in sched.master.mq.qrefs], [('schedulers', '13', 'updated')]
+        )
+
+    @defer.inlineCallbacks
+    def test_trigger_completed_before_subscription(self):
+        sched = yield self.makeScheduler()
+        yield self.master.startService()
+
+        startConsuming = self.master.mq.startConsuming
+
+        @defer.inlineCallbacks
+        def completeThenStartConsuming(callback, filter, persistent_name=None):
+            # the buildset completes before the subscription is in place
+            buildsets = yield self.master.db.buildsets.getBuildsets()
+            yield self.master.db.buildsets.completeBuildset(buildsets[0].bsid, results=2)
+            consumer = yield startConsuming(callback, filter, persistent_name)
+            return consumer
+
+        self.patch(self.master.mq, 'startConsuming', completeThenStartConsuming)
+
+        idsDeferred, d = sched.trigger(False)
+        _, brids = yield idsDeferred
+
+        results = yield d
+        self.assertEqual(results, (2, brids))
+        self.assertEqual(sched._waiters, {})
+        self.assertEqual(
+            [q.filter for q in sched.master.mq.qrefs], [('schedulers', '13', 'updated')]
+        )
+
     @defer.inlineCallbacks
     def test_trigger_with_sourcestamp(self):
         # Test triggering a scheduler with a sourcestamp, and see that
@@ -13,9 +13,12 @@
 #
 # Copyright Buildbot Team Members
 
+import io
 import os
+import tempfile
 from unittest import mock
 
+from parameterized import parameterized
 from twisted.internet import defer
 from twisted.trial import unittest
 
@@ -23,9 +26,12 @@ from buildbot.db import connector
 from buildbot.db import model
 from buildbot.scripts import create_master
 from buildbot.test.reactor import TestReactorMixin
-from buildbot.test.util import dirs
 from buildbot.test.util import misc
 from buildbot.test.util import www
+from buildbot.util.twisted import async_to_deferred
+
+# the default basedir is only used by tests that never touch it on disk
+_DEFAULT_BASEDIR = os.path.abspath('basedir')
 
 
 def mkconfig(**kwargs):
@@ -34,7 +40,7 @@ def mkconfig(**kwargs):
         "relocatable": False,
         "config": 'master.cfg',
         "db": 'sqlite:///state.sqlite',
-        "basedir": os.path.abspath('basedir'),
+        "basedir": _DEFAULT_BASEDIR,
         "quiet": False,
         **{'no-logrotate': False, 'log-size': 10000000, 'log-count': 10},
     }
@@ -51,80 +57,81 @@ class TestCreateMaster(misc.StdoutAssertionsMixin, unittest.TestCase):
 
     # tests
 
-    @defer.inlineCallbacks
-    def do_test_createMaster(self, config):
+    async def do_test_createMaster(self, config):
         # mock out everything that createMaster calls, then check that
         # they are called, in order
         functions = ['makeBasedir', 'makeTAC', 'makeSampleConfig', 'createDB']
         repls = {}
         calls = []
         for fn in functions:
-            repl = repls[fn] = mock.Mock(name=fn)
+            repl = repls[fn] = mock.Mock(spec=getattr(create_master, fn), name=fn)
             repl.side_effect = lambda config, fn=fn: calls.append(fn)
             self.patch(create_master, fn, repl)
         repls['createDB'].side_effect = lambda config: calls.append(fn) or defer.succeed(None)
-        rc = yield create_master.createMaster(config)
+        rc = await create_master.createMaster(config)
 
         self.assertEqual(rc, 0)
         self.assertEqual(calls, functions)
         for repl in repls.values():
             repl.assert_called_with(config)
 
-    @defer.inlineCallbacks
-    def test_createMaster_quiet(self):
-        yield self.do_test_createMaster(mkconfig(quiet=True))
+    @async_to_deferred
+    async def test_createMaster_quiet(self):
+        await self.do_test_createMaster(mkconfig(quiet=True))
 
         self.assertWasQuiet()
 
-    @defer.inlineCallbacks
-    def test_createMaster_loud(self):
-        yield self.do_test_createMaster(mkconfig(quiet=False))
+    @async_to_deferred
+    async def test_createMaster_loud(self):
+        await self.do_test_createMaster(mkconfig(quiet=False))
 
         self.assertInStdout('buildmaster configured in')
 
 
 class TestCreateMasterFunctions(
     www.WwwTestMixin,
-    dirs.DirsMixin,
     misc.StdoutAssertionsMixin,
     TestReactorMixin,
     unittest.TestCase,
 ):
     def setUp(self):
         self.setup_test_reactor()
-        self.setUpDirs('test')
-        self.basedir = os.path.abspath(os.path.join('test', 'basedir'))
+        # the tests only write a few small files, keep them in the system's
+        # temporary directory
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        self.testdir = tempdir.name
+        self.basedir = os.path.join(self.testdir, 'basedir')
+        self._tac_cache = None
         self.setUpStdoutAssertions()
 
+    def _tac_content(self):
+        # each test writes buildbot.tac before checking it, so it only needs
+        # to be read once
+        if self._tac_cache is None:
+            with open(os.path.join(self.testdir, 'buildbot.tac'), encoding='utf-8') as f:
+                self._tac_cache = f.read()
+        return self._tac_cache
+
+    def renderTacInMemory(self, config):
+        # only the rendered content matters here, so capture the write instead
+        # of going through the filesystem
+        tac = io.StringIO()
+        tac.close = lambda: None  # keep the content readable after the write
+
+        def fake_open(path, mode='r', **kwargs):
+            self.assertEqual((path, mode), (os.path.join(config['basedir'], 'buildbot.tac'), 'w'))
+            return tac
+
+        with mock.patch.object(create_master, 'open', fake_open, create=True):
+            create_master.makeTAC(config)
+        self._tac_cache = tac.getvalue()
+
     def assertInTacFile(self, str):
-        with open(os.path.join('test', 'buildbot.tac'), encoding='utf-8') as f:
-            content = f.read()
-        self.assertIn(str, content)
+        self.assertIn(str, self._tac_content())
 
     def assertNotInTacFile(self, str):
-        with open(os.path.join('test', 'buildbot.tac'), encoding='utf-8') as f:
-            content = f.read()
-        self.assertNotIn(str, content)
-
-    def assertDBSetup(self, basedir=None, db_url='sqlite:///state.sqlite', verbose=True):
-        # mock out the database setup
-        self.db = mock.Mock()
-        self.db.setup.side_effect = lambda *a, **k: defer.succeed(None)
-        self.DBConnector = mock.Mock()
-        self.DBConnector.return_value = self.db
-        self.patch(connector, 'DBConnector', self.DBConnector)
-
-        basedir = basedir or self.basedir
-        # pylint: disable=unsubscriptable-object
-        self.assertEqual(
-            {
-                "basedir": self.DBConnector.call_args[0][1],
-                "db_url": self.DBConnector.call_args[0][0].mkconfig.db['db_url'],
-                "verbose": self.db.setup.call_args[1]['verbose'],
-                "check_version": self.db.setup.call_args[1]['check_version'],
-            },
-            {"basedir": self.basedir, "db_url": db_url, "verbose": True, "check_version": False},
-        )
+        self.assertNotIn(str, self._tac_content())
 
     # tests
 
@@ -145,83 +152,74 @@ class TestCreateMasterFunctions(
         create_master.makeBasedir(mkconfig(basedir=self.basedir))
         self.assertInStdout('updating existing installation')
 
-    def test_makeTAC(self):
-        create_master.makeTAC(mkconfig(basedir='test'))
-        self.assertInTacFile("Application('buildmaster')")
-        self.assertWasQuiet()
-
-    def test_makeTAC_relocatable(self):
-        create_master.makeTAC(mkconfig(basedir='test', relocatable=True))
-        self.assertInTacFile("basedir = '.'")  # repr() prefers ''
-        self.assertWasQuiet()
-
-    def test_makeTAC_no_logrotate(self):
-        create_master.makeTAC(mkconfig(basedir='test', **{'no-logrotate': True}))
-        self.assertNotInTacFile("import Log")
-        self.assertWasQuiet()
-
-    def test_makeTAC_int_log_count(self):
-        create_master.makeTAC(mkconfig(basedir='test', **{'log-count': 30}))
-        self.assertInTacFile("\nmaxRotatedFiles = 30\n")
-        self.assertWasQuiet()
-
-    def test_makeTAC_str_log_count(self):
-        with self.assertRaises(TypeError):
-            create_master.makeTAC(mkconfig(basedir='test', **{'log-count': '30'}))
-
-    def test_makeTAC_none_log_count(self):
-        create_master.makeTAC(mkconfig(basedir='test', **{'log-count': None}))
-        self.assertInTacFile("\nmaxRotatedFiles = None\n")
-        self.assertWasQuiet()
-
-    def test_makeTAC_int_log_size(self):
-        create_master.makeTAC(mkconfig(basedir='test', **{'log-size': 3000}))
-        self.assertInTacFile("\nrotateLength = 3000\n")
+    @parameterized.expand([
+        ('default', {}, ["Application('buildmaster')", "\nmaxRotatedFiles = 10\n"], []),
+        ('relocatable', {'relocatable': True}, ["basedir = '.'"], []),  # repr() prefers ''
+        ('no_logrotate', {'no-logrotate': True}, [], ["import Log"]),
+        # the log settings are independent, so check them with a single render
+        (
+            'int_log_settings',
+            {'log-count': 30, 'log-size': 3000},
+            ["\nmaxRotatedFiles = 30\n", "\nrotateLength = 3000\n"],
+            [],
+        ),
+        ('none_log_count', {'log-count': None}, ["\nmaxRotatedFiles = None\n"], []),
+    ])
+    def test_makeTAC(self, name, config_overrides, expected, unexpected):
+        self.renderTacInMemory(mkconfig(basedir=self.testdir, **config_overrides))
+        for text in expected:
+            self.assertInTacFile(text)
+        for text in unexpected:
+            self.assertNotInTacFile(text)
         self.assertWasQuiet()
 
-    def test_makeTAC_str_log_size(self):
+    @parameterized.expand([
+        ('log_count', 'log-count', '30'),
+        ('log_size', 'log-size', '3000'),
+    ])
+    def test_makeTAC_str(self, name, key, value):
         with self.assertRaises(TypeError):
-            create_master.makeTAC(mkconfig(basedir='test', **{'log-size': '3000'}))
+            create_master.makeTAC(mkconfig(basedir=self.testdir, **{key: value}))
 
     def test_makeTAC_existing_incorrect(self):
-        with open(os.path.join('test', 'buildbot.tac'), "w", encoding='utf-8') as f:
+        with open(os.path.join(self.testdir, 'buildbot.tac'), "w", encoding='utf-8') as f:
             f.write('WRONG')
-        create_master.makeTAC(mkconfig(basedir='test'))
+        create_master.makeTAC(mkconfig(basedir=self.testdir))
         self.assertInTacFile("WRONG")
-        self.assertTrue(os.path.exists(os.path.join('test', 'buildbot.tac.new')))
+        self.assertTrue(os.path.exists(os.path.join(self.testdir, 'buildbot.tac.new')))
         self.assertInStdout('not touching existing buildbot.tac')
 
     def test_makeTAC_existing_incorrect_quiet(self):
-        with open(os.path.join('test', 'buildbot.tac'), "w", encoding='utf-8') as f:
+        with open(os.path.join(self.testdir, 'buildbot.tac'), "w", encoding='utf-8') as f:
             f.write('WRONG')
-        create_master.makeTAC(mkconfig(basedir='test', quiet=True))
+        create_master.makeTAC(mkconfig(basedir=self.testdir, quiet=True))
         self.assertInTacFile("WRONG")
         self.assertWasQuiet()
 
     def test_makeTAC_existing_correct(self):
-        create_master.makeTAC(mkconfig(basedir='test', quiet=True))
-        create_master.makeTAC(mkconfig(basedir='test'))
-        self.assertFalse(os.path.exists(os.path.join('test', 'buildbot.tac.new')))
+        create_master.makeTAC(mkconfig(basedir=self.testdir, quiet=True))
+        create_master.makeTAC(mkconfig(basedir=self.testdir))
+        self.assertFalse(os.path.exists(os.path.join(self.testdir, 'buildbot.tac.new')))
         self.assertInStdout('and is correct')
 
     def test_makeSampleConfig(self):
-        create_master.makeSampleConfig(mkconfig(basedir='test'))
-        self.assertTrue(os.path.exists(os.path.join('test', 'master.cfg.sample')))
+        create_master.makeSampleConfig(mkconfig(basedir=self.testdir))
+        self.assertTrue(os.path.exists(os.path.join(self.testdir, 'master.cfg.sample')))
         self.assertInStdout('creating ')
 
     def test_makeSampleConfig_db(self):
-        create_master.makeSampleConfig(mkconfig(basedir='test', db='XXYYZZ', quiet=True))
-        with open(os.path.join('test', 'master.cfg.sample'), encoding='utf-8') as f:
+        create_master.makeSampleConfig(mkconfig(basedir=self.testdir, db='XXYYZZ', quiet=True))
+        with open(os.path.join(self.testdir, 'master.cfg.sample'), encoding='utf-8') as f:
             self.assertIn("XXYYZZ", f.read())
         self.assertWasQuiet()
 
-    @defer.inlineCallbacks
-    def test_createDB(self):
+    @async_to_deferred
+    async def test_createDB(self):
         setup = mock.Mock(side_effect=lambda **kwargs: defer.succeed(None))
         self.patch(connector.DBConnector, 'setup', setup)
         upgrade = mock.Mock(side_effect=lambda **kwargs: defer.succeed(None))
         self.patch(model.Model, 'upgrade', upgrade)
-        yield create_master.createDB(mkconfig(basedir='test', quiet=True))
-        setup.asset_called_with(check_version=False, verbose=False)
+        await create_master.createDB(mkconfig(basedir=self.testdir, quiet=True))
+        setup.assert_called_with(check_version=False, verbose=False)
         upgrade.assert_called_with()
         self.assertWasQuiet()
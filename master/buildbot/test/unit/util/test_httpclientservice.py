@@ -240,6 +240,16 @@ class HTTPClientServiceTestTReq(HTTPClientServiceTestBase):
             'http://foo/bar', agent=mock.ANY, headers={}
         )
 
+    @defer.inlineCallbacks
+    def test_agent_reused(self):
+        with assertProducesWarning(DeprecationWarning):
+            yield self._http.get('/bar')
+        with assertProducesWarning(DeprecationWarning):
+            yield self._http.get('/baz')
+        agents = [c.kwargs['agent'] for c in httpclientservice.treq.get.call_args_list]
+        self.assertEqual(len(agents), 2)
+        self.assertIs(agents[0], agents[1])
+
     @defer.inlineCallbacks
     def test_post_headers(self):
         self.base_headers.update({'X-TOKEN': 'XXXYYY'})
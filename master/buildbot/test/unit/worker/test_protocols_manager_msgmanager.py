@@ -16,16 +16,20 @@
 from __future__ import annotations
 
 import base64
+import re
 from typing import TYPE_CHECKING
 from typing import Any
 from unittest import mock
 
 import msgpack
 from autobahn.websocket.types import ConnectionDeny
+from autobahn.websocket.types import ConnectionRequest
 from parameterized import parameterized
 from twisted.internet import defer
 from twisted.trial import unittest
 
+from buildbot.test.util.logging import LoggingMixin
+from buildbot.util.twisted import async_to_deferred
 from buildbot.worker.protocols.base import FileReaderImpl
 from buildbot.worker.protocols.base import FileWriterImpl
 from buildbot.worker.protocols.base import RemoteCommandImpl
@@ -41,6 +45,25 @@ if TYPE_CHECKING:
     from buildbot.util.twisted import InlineCallbacksType
 
 
+def make_connection_request(authorization: str) -> ConnectionRequest:
+    # onConnect() only looks at the peer and the headers
+    return ConnectionRequest(
+        peer='',
+        headers={'authorization': authorization},
+        host='',
+        path='/',
+        params={},
+        version=13,
+        origin=None,
+        protocols=[],
+        extensions=[],
+    )
+
+
+# msgpack.packb() creates a new Packer for every call, reuse a single one instead
+_packer = msgpack.Packer()
+
+
 class TestHttpAuthorization(unittest.TestCase):
     def test_encode(self) -> None:
         result = encode_http_authorization_header(b'name', b'pass')
@@ -76,6 +99,10 @@ class TestHttpAuthorization(unittest.TestCase):
         with self.assertRaises(ValueError):
             decode_http_authorization_header('Basic test%test')
 
+        # would decode to valid credentials if the character was ignored
+        with self.assertRaises(ValueError):
+            decode_http_authorization_header('Basic bmFtZTpw%YXNz')
+
     def test_credentials_do_not_contain_colon(self) -> None:
         value = 'Basic ' + base64.b64encode(b'TestTestTest').decode()
         with self.assertRaises(ValueError):
@@ -86,7 +113,7 @@ class TestException(Exception):
     pass
 
 
-class TestBuildbotWebSocketServerProtocol(unittest.TestCase):
+class TestBuildbotWebSocketServerProtocol(LoggingMixin, unittest.TestCase):
     def setUp(self) -> None:
         self.protocol = BuildbotWebSocketServerProtocol()
         self.protocol.sendMessage = mock.Mock()
@@ -99,29 +126,17 @@ class TestBuildbotWebSocketServerProtocol(unittest.TestCase):
         msg: dict[str, Any],
         expected: dict[str, Any],
     ) -> InlineCallbacksType[None]:
-        msg = msg.copy()
+        # msg and expected are built for each call, so they are updated in place
         msg['seq_number'] = self.seq_number
-
-        expected = expected.copy()
         expected['seq_number'] = self.seq_number
         self.seq_number += 1
 
-        protocol.onMessage(msgpack.packb(msg), True)
+        protocol.onMessage(_packer.pack(msg), True)
         yield protocol._deferwaiter.wait()
         args_tuple, _ = protocol.sendMessage.call_args
         result = msgpack.unpackb(args_tuple[0], raw=False)
         self.assertEqual(result, expected)
 
-    def send_msg_get_result(self, msg: dict[str, Any]) -> Any:
-        msg = msg.copy()
-        msg['seq_number'] = self.seq_number
-        self.seq_number += 1
-
-        self.protocol.onMessage(msgpack.packb(msg), True)
-
-        args_tuple, _ = self.protocol.sendMessage.call_args
-        return msgpack.unpackb(args_tuple[0], raw=False)['result']
-
     @defer.inlineCallbacks
     def connect_authenticated_worker(self) -> InlineCallbacksType[None]:
         # worker has to be authenticated before opening the connection
@@ -130,9 +145,7 @@ class TestBuildbotWebSocketServerProtocol(unittest.TestCase):
 
         self.setup_mock_users({'name': ('pass', pfactory)})
 
-        request = mock.Mock()
-        request.headers = {"authorization": 'Basic bmFtZTpwYXNz'}
-        request.peer = ''
+        request = make_connection_request('Basic bmFtZTpwYXNz')
 
         yield self.protocol.onConnect(request)
         yield self.protocol.onOpen()
@@ -142,30 +155,34 @@ class TestBuildbotWebSocketServerProtocol(unittest.TestCase):
         self.protocol.factory.buildbot_dispatcher = mock.Mock()
         self.protocol.factory.buildbot_dispatcher.users = users
 
+    # the messages are constant, so pack them only once
     @parameterized.expand([
-        ('update_op', {'seq_number': 1}),
-        ('update_seq_number', {'op': 'update'}),
-        ('complete_op', {'seq_number': 1}),
-        ('complete_seq_number', {'op': 'complete'}),
-        ('update_upload_file_write_op', {'seq_number': 1}),
-        ('update_upload_file_write_seq_number', {'op': 'update_upload_file_write'}),
-        ('update_upload_file_utime_op', {'seq_number': 1}),
-        ('update_upload_file_utime_seq_number', {'op': 'update_upload_file_utime'}),
-        ('update_upload_file_close_op', {'seq_number': 1}),
-        ('update_upload_file_close_seq_number', {'op': 'update_upload_file_close'}),
-        ('update_read_file_op', {'seq_number': 1}),
-        ('update_read_file_seq_number', {'op': 'update_read_file'}),
-        ('update_read_file_close_op', {'seq_number': 1}),
-        ('update_read_file_close_seq_number', {'op': 'update_read_file_close'}),
-        ('update_upload_directory_unpack_op', {'seq_number': 1}),
-        ('update_upload_directory_unpack_seq_number', {'op': 'update_upload_directory_unpack'}),
-        ('update_upload_directory_write_op', {'seq_number': 1}),
-        ('update_upload_directory_write_seq_number', {'op': 'update_upload_directory_write'}),
+        (name, msg, _packer.pack(msg))
+        for name, msg in [
+            ('update_op', {'seq_number': 1}),
+            ('update_seq_number', {'op': 'update'}),
+            ('complete_op', {'seq_number': 1}),
+            ('complete_seq_number', {'op': 'complete'}),
+            ('update_upload_file_write_op', {'seq_number': 1}),
+            ('update_upload_file_write_seq_number', {'op': 'update_upload_file_write'}),
+            ('update_upload_file_utime_op', {'seq_number': 1}),
+            ('update_upload_file_utime_seq_number', {'op': 'update_upload_file_utime'}),
+            ('update_upload_file_close_op', {'seq_number': 1}),
+            ('update_upload_file_close_seq_number', {'op': 'update_upload_file_close'}),
+            ('update_read_file_op', {'seq_number': 1}),
+            ('update_read_file_seq_number', {'op': 'update_read_file'}),
+            ('update_read_file_close_op', {'seq_number': 1}),
+            ('update_read_file_close_seq_number', {'op': 'update_read_file_close'}),
+            ('update_upload_directory_unpack_op', {'seq_number': 1}),
+            ('update_upload_directory_unpack_seq_number', {'op': 'update_upload_directory_unpack'}),
+            ('update_upload_directory_write_op', {'seq_number': 1}),
+            ('update_upload_directory_write_seq_number', {'op': 'update_upload_directory_write'}),
+        ]
     ])
-    def test_msg_missing_arg(self, name: str, msg: dict[str, Any]) -> None:
-        with mock.patch('twisted.python.log.msg') as mock_log:
-            self.protocol.onMessage(msgpack.packb(msg), True)
-            mock_log.assert_any_call(f'Invalid message from worker: {msg}')
+    def test_msg_missing_arg(self, name: str, msg: dict[str, Any], payload: bytes) -> None:
+        self.setUpLogging()
+        self.protocol.onMessage(payload, True)
+        self.assertLogged(re.escape(f'Invalid message from worker: {msg}'))
 
         # if msg does not have 'sep_number' or 'op', response sendMessage should not be called
         self.protocol.sendMessage.assert_not_called()
@@ -294,47 +311,40 @@ class TestBuildbotWebSocketServerProtocol(unittest.TestCase):
         }
         yield self.send_msg_check_response(self.protocol, msg, expected)
 
-    @defer.inlineCallbacks
-    def test_missing_authorization_header(self) -> InlineCallbacksType[None]:
-        request = mock.Mock()
-        request.headers = {"authorization": ''}
-        request.peer = ''
+    @async_to_deferred
+    async def test_missing_authorization_header(self) -> None:
+        request = make_connection_request('')
 
         with self.assertRaises(ConnectionDeny):
-            yield self.protocol.onConnect(request)
+            await self.protocol.onConnect(request)
 
-    @defer.inlineCallbacks
-    def test_auth_password_does_not_match(self) -> InlineCallbacksType[None]:
+    @async_to_deferred
+    async def test_auth_password_does_not_match(self) -> None:
         pfactory = mock.Mock()
         pfactory.connection = mock.Mock()
 
         self.setup_mock_users({'username': ('password', pfactory)})
 
-        request = mock.Mock()
-        request.headers = {
-            "authorization": encode_http_authorization_header(b'username', b'wrong_password')
-        }
-        request.peer = ''
+        request = make_connection_request(
+            encode_http_authorization_header(b'username', b'wrong_password')
+        )
 
         with self.assertRaises(ConnectionDeny):
-            yield self.protocol.onConnect(request)
+            await self.protocol.onConnect(request)
 
-    @defer.inlineCallbacks
-    def test_auth_username_unknown(self) -> InlineCallbacksType[None]:
+    @async_to_deferred
+    async def test_auth_username_unknown(self) -> None:
         pfactory = mock.Mock()
         pfactory.connection = mock.Mock()
 
         self.setup_mock_users({'username': ('pass', pfactory)})
 
-        request = mock.Mock()
-
-        request.headers = {
-            "authorization": encode_http_authorization_header(b'wrong_username', b'pass')
-        }
-        request.peer = ''
+        request = make_connection_request(
+            encode_http_authorization_header(b'wrong_username', b'pass')
+        )
 
         with self.assertRaises(ConnectionDeny):
-            yield self.protocol.onConnect(request)
+            await self.protocol.onConnect(request)
 
     @defer.inlineCallbacks
     def test_update_success(self) -> InlineCallbacksType[None]:
@@ -535,7 +545,7 @@ class TestBuildbotWebSocketServerProtocol(unittest.TestCase):
     def test_onMessage_not_isBinary(self) -> None:
         # if isBinary is False, sendMessage should not be called
         msg: dict[str, Any] = {}
-        self.protocol.onMessage(msgpack.packb(msg), False)
+        self.protocol.onMessage(_packer.pack(msg), False)
         self.seq_number += 1
         self.protocol.sendMessage.assert_not_called()
 
@@ -572,7 +582,7 @@ class TestBuildbotWebSocketServerProtocol(unittest.TestCase):
 
         # master got an answer from worker through onMessage
         msg = {'seq_number': seq_num, 'op': 'response', 'result': 'test_result'}
-        self.protocol.onMessage(msgpack.packb(msg), isBinary=True)
+        self.protocol.onMessage(_packer.pack(msg), isBinary=True)
         self.assertEqual(d.called, True)
         res = yield d
         self.assertEqual(res, 'test_result')
@@ -593,16 +603,16 @@ class TestBuildbotWebSocketServerProtocol(unittest.TestCase):
             'is_exception': True,
             'result': 'error_result',
         }
-        self.protocol.onMessage(msgpack.packb(msg_response), isBinary=True)
+        self.protocol.onMessage(_packer.pack(msg_response), isBinary=True)
         self.assertEqual(d.called, True)
         with self.assertRaises(RemoteWorkerError):
             yield d
 
-    @defer.inlineCallbacks
-    def test_get_message_result_no_worker_connection(self) -> InlineCallbacksType[None]:
+    @async_to_deferred
+    async def test_get_message_result_no_worker_connection(self) -> None:
         # master can not send any messages if connection is not established
         with self.assertRaises(ConnectioLostError):
-            yield self.protocol.get_message_result({'op': 'getWorkerInfo'})
+            await self.protocol.get_message_result({'op': 'getWorkerInfo'})
 
     @defer.inlineCallbacks
     def test_onClose_connection_lost_error(self) -> InlineCallbacksType[None]:
@@ -43,6 +43,43 @@ class AvatarResource(TestReactorMixin, www.WwwTestMixin, unittest.TestCase):
         res = yield self.render_resource(rsrc, b'/')
         self.assertEqual(res, {"redirected": avatar.AvatarResource.defaultAvatarUrl})
 
+    @defer.inlineCallbacks
+    def test_cache_control(self):
+        master = yield self.make_master(
+            url='http://a/b/', auth=auth.NoAuth(), avatar_methods=[avatar.AvatarGravatar()]
+        )
+        rsrc = avatar.AvatarResource(master)
+        rsrc.reconfigResource(master.config)
+
+        for _ in range(2):
+            # a lookup, then a cache hit
+            request = self.make_request(b'/?email=foo')
+            yield self.render_resource(rsrc, request=request)
+            self.assertEqual(request.headers[b'cache-control'], [b'public, max-age=86400'])
+
+    @defer.inlineCallbacks
+    def test_cache_control_content(self):
+        master = yield self.make_master(
+            url='http://a/b/', auth=auth.NoAuth(), avatar_methods=[TestAvatar()]
+        )
+        rsrc = avatar.AvatarResource(master)
+        rsrc.reconfigResource(master.config)
+
+        request = self.make_request(b'/?email=foo')
+        yield self.render_resource(rsrc, request=request)
+        self.assertEqual(request.headers[b'cache-control'], [b'private, max-age=86400'])
+
+    @defer.inlineCallbacks
+    def test_cache_control_default(self):
+        master = yield self.make_master(url='http://a/b/', auth=auth.NoAuth(), avatar_methods=[])
+        rsrc = avatar.AvatarResource(master)
+        rsrc.reconfigResource(master.config)
+
+        request = self.make_request(b'/')
+        res = yield self.render_resource(rsrc, request=request)
+        self.assertEqual(res, {"redirected": avatar.AvatarResource.defaultAvatarUrl})
+        self.assertNotIn(b'cache-control', request.headers)
+
     @defer.inlineCallbacks
     def test_gravatar(self):
         master = yield self.make_master(
@@ -55,7 +92,7 @@ class AvatarResource(TestReactorMixin, www.WwwTestMixin, unittest.TestCase):
         self.assertEqual(
             res,
             {
-                "redirected": b'//www.gravatar.com/avatar/acbd18db4cc2f85ce'
+                "redirected": b'https://www.gravatar.com/avatar/acbd18db4cc2f85ce'
                 b'def654fccc4a4d8?d=retro&s=32'
             },
         )
@@ -112,11 +149,54 @@ class AvatarResource(TestReactorMixin, www.WwwTestMixin, unittest.TestCase):
         self.assertEqual(
             res,
             {
-                "redirected": b'//www.gravatar.com/avatar/acbd18db4cc2f85ce'
+                "redirected": b'https://www.gravatar.com/avatar/acbd18db4cc2f85ce'
                 b'def654fccc4a4d8?d=retro&s=32'
             },
         )
 
+    @defer.inlineCallbacks
+    def test_cache_bounded(self):
+        master = yield self.make_master(
+            url='http://a/b/', auth=auth.NoAuth(), avatar_methods=[avatar.AvatarGravatar()]
+        )
+        rsrc = avatar.AvatarResource(master)
+        rsrc.reconfigResource(master.config)
+        rsrc.cache_max_size = 2
+
+        yield self.render_resource(rsrc, b'/?email=foo')
+        yield self.render_resource(rsrc, b'/?email=bar')
+        # a cache hit makes foo the most recently used entry, so bar gets evicted
+        yield self.render_resource(rsrc, b'/?email=FOO')
+        yield self.render_resource(rsrc, b'/?email=baz')
+        self.assertEqual(list(rsrc.cache), [(b'foo', None, 32), (b'baz', None, 32)])
+
+    @defer.inlineCallbacks
+    def test_concurrent_lookups_coalesced(self):
+        lookups = []
+
+        class SlowAvatar(avatar.AvatarBase):
+            def getUserAvatar(self, email, username, size, defaultAvatarUrl):
+                d = defer.Deferred()
+                lookups.append(d)
+                return d
+
+        master = yield self.make_master(
+            url='http://a/b/', auth=auth.NoAuth(), avatar_methods=[SlowAvatar()]
+        )
+        rsrc = avatar.AvatarResource(master)
+        rsrc.reconfigResource(master.config)
+
+        d1 = self.render_resource(rsrc, b'/?email=foo')
+        d2 = self.render_resource(rsrc, b'/?email=FOO')
+        # the second request waits for the lookup started by the first one
+        self.assertEqual(len(lookups), 1)
+
+        lookups[0].callback((b"image/png", b"avatar"))
+        res1 = yield d1
+        res2 = yield d2
+        self.assertEqual((res1, res2), (b"avatar", b"avatar"))
+        self.assertEqual(rsrc._lookups, {})
+
 
 github_username_search_reply = {
     "login": "defunkt",
@@ -606,6 +686,40 @@ class GitHubAvatar(TestReactorMixin, www.WwwTestMixin, unittest.TestCase):
             res, {"redirected": b'https://avatars3.githubusercontent.com/u/42424242?v=4&s=32'}
         )
 
+    @defer.inlineCallbacks
+    def test_username_cached_case_insensitive(self):
+        username_search_endpoint = '/users/defunkt'
+        self._http.expect(
+            'get',
+            username_search_endpoint,
+            content_json=github_username_search_reply,
+            headers={'Accept': 'application/vnd.github.v3+json'},
+        )
+        res = yield self.render_resource(self.rsrc, b'/?username=defunkt')
+        self.assertEqual(
+            res, {"redirected": b'https://avatars3.githubusercontent.com/u/42424242?v=4&s=32'}
+        )
+        res = yield self.render_resource(self.rsrc, b'/?username=DeFunkt')
+        self.assertEqual(
+            res, {"redirected": b'https://avatars3.githubusercontent.com/u/42424242?v=4&s=32'}
+        )
+
+    @defer.inlineCallbacks
+    def test_username_not_found_cached(self):
+        username_search_endpoint = '/users/inexistent'
+        self._http.expect(
+            'get',
+            username_search_endpoint,
+            code=404,
+            content_json=github_username_not_found_reply,
+            headers={'Accept': 'application/vnd.github.v3+json'},
+        )
+        res = yield self.render_resource(self.rsrc, b'/?username=inexistent')
+        self.assertEqual(res, {"redirected": b'img/nobody.png'})
+        # Second request will give same result but without an HTTP request
+        res = yield self.render_resource(self.rsrc, b'/?username=inexistent')
+        self.assertEqual(res, {"redirected": b'img/nobody.png'})
+
     @defer.inlineCallbacks
     def test_email(self):
         email_search_endpoint = '/search/users?q=defunkt%40defunkt.com+in%3Aemail'
@@ -714,6 +828,105 @@ class GitHubAvatar(TestReactorMixin, www.WwwTestMixin, unittest.TestCase):
         res = yield self.render_resource(self.rsrc, b'/?email=error@defunkt.com')
         self.assertEqual(res, {"redirected": b'img/nobody.png'})
 
+    @defer.inlineCallbacks
+    def test_username_not_found_negative_cache(self):
+        username_search_endpoint = '/users/inexistent'
+        self._http.expect(
+            'get',
+            username_search_endpoint,
+            code=404,
+            content_json=github_username_not_found_reply,
+            headers={'Accept': 'application/vnd.github.v3+json'},
+        )
+        res = yield self.render_resource(self.rsrc, b'/?username=inexistent')
+        self.assertEqual(res, {"redirected": b'img/nobody.png'})
+        # another size is another cache entry of the resource, but GitHub is not asked again
+        res = yield self.render_resource(self.rsrc, b'/?username=inexistent&size=64')
+        self.assertEqual(res, {"redirected": b'img/nobody.png'})
+
+        self.reactor.advance(avatar.AvatarGitHub.negative_cache_ttl)
+        self._http.expect(
+            'get',
+            username_search_endpoint,
+            code=404,
+            content_json=github_username_not_found_reply,
+            headers={'Accept': 'application/vnd.github.v3+json'},
+        )
+        res = yield self.render_resource(self.rsrc, b'/?username=inexistent&size=48')
+        self.assertEqual(res, {"redirected": b'img/nobody.png'})
+
+    @defer.inlineCallbacks
+    def test_email_error_not_cached(self):
+        for _ in range(2):
+            self._http.expect(
+                'get',
+                '/search/users?q=error%40defunkt.com+in%3Aemail',
+                code=500,
+                headers={'Accept': 'application/vnd.github.v3+json'},
+            )
+            self._http.expect(
+                'get',
+                '/search/commits?per_page=1&q=author-email%3Aerror%40defunkt.com'
+                '&sort=committer-date',
+                code=500,
+                headers={
+                    'Accept': 'application/vnd.github.v3+json,application/vnd.github.cloak-preview'
+                },
+            )
+        for _ in range(2):
+            res = yield self.render_resource(self.rsrc, b'/?email=error@defunkt.com')
+            self.assertEqual(res, {"redirected": b'img/nobody.png'})
+
+    @defer.inlineCallbacks
+    def test_invalid_username_not_looked_up(self):
+        res = yield self.render_resource(self.rsrc, b'/?username=Some%20Body')
+        self.assertEqual(res, {"redirected": b'img/nobody.png'})
+        res = yield self.render_resource(self.rsrc, b'/?username=' + b'a' * 40)
+        self.assertEqual(res, {"redirected": b'img/nobody.png'})
+
+    @defer.inlineCallbacks
+    def test_legacy_username(self):
+        self._http.expect(
+            'get',
+            '/users/legacy--user-',
+            content_json=github_username_search_reply,
+            headers={'Accept': 'application/vnd.github.v3+json'},
+        )
+        res = yield self.render_resource(self.rsrc, b'/?username=legacy--user-')
+        self.assertEqual(
+            res, {"redirected": b'https://avatars3.githubusercontent.com/u/42424242?v=4&s=32'}
+        )
+
+    @defer.inlineCallbacks
+    def test_invalid_email_not_searched(self):
+        res = yield self.render_resource(self.rsrc, b'/?email=somebody')
+        self.assertEqual(res, {"redirected": b'img/nobody.png'})
+
+    @defer.inlineCallbacks
+    def test_noreply_email(self):
+        self._http.expect(
+            'get',
+            '/users/defunkt',
+            content_json=github_username_search_reply,
+            headers={'Accept': 'application/vnd.github.v3+json'},
+        )
+        res = yield self.render_resource(
+            self.rsrc, b'/?email=42424242%2Bdefunkt@users.noreply.github.com'
+        )
+        self.assertEqual(
+            res, {"redirected": b'https://avatars3.githubusercontent.com/u/42424242?v=4&s=32'}
+        )
+
+    def test_add_size_to_url(self):
+        method = avatar.AvatarGitHub()
+        self.assertEqual(method._add_size_to_url('https://a.b/u/1', 32), 'https://a.b/u/1?s=32')
+        self.assertEqual(
+            method._add_size_to_url('https://a.b/u/1?v=4', 32), 'https://a.b/u/1?v=4&s=32'
+        )
+        self.assertEqual(
+            method._add_size_to_url('https://a.b/u/1?v=4#x', 32), 'https://a.b/u/1?v=4&s=32#x'
+        )
+
 
 class GitHubAvatarBasicAuth(TestReactorMixin, www.WwwTestMixin, unittest.TestCase):
     @defer.inlineCallbacks
@@ -767,3 +980,95 @@ class GitHubAvatarBasicAuth(TestReactorMixin, www.WwwTestMixin, unittest.TestCas
         self.assertEqual(
             res, {'redirected': b'https://avatars3.githubusercontent.com/u/42424242?v=4&s=32'}
         )
+
+
+class GitHubAvatarBatched(TestReactorMixin, www.WwwTestMixin, unittest.TestCase):
+    @defer.inlineCallbacks
+    def setUp(self):
+        self.setup_test_reactor()
+
+        master = yield self.make_master(
+            url='http://a/b/',
+            auth=auth.NoAuth(),
+            avatar_methods=[avatar.AvatarGitHub(token="abcd", batch_username_lookups=True)],
+        )
+
+        self.rsrc = avatar.AvatarResource(master)
+        self.rsrc.reconfigResource(master.config)
+
+        headers = {
+            'User-Agent': 'Buildbot',
+            'Authorization': 'token abcd',
+        }
+        self._http = yield fakehttpclientservice.HTTPClientService.getService(
+            master,
+            self,
+            avatar.AvatarGitHub.DEFAULT_GITHUB_API_URL,
+            headers=headers,
+            debug=False,
+            verify=True,
+        )
+        yield self.master.startService()
+        self.addCleanup(self.master.stopService)
+
+    def test_batch_requires_token(self):
+        with self.assertRaises(config.ConfigErrors):
+            avatar.AvatarGitHub(batch_username_lookups=True)
+
+    def test_graphql_url_enterprise(self):
+        method = avatar.AvatarGitHub(github_api_endpoint='https://ghe.example.com/api/v3/')
+        self.assertEqual(method.graphql_url, 'https://ghe.example.com/api/graphql')
+
+    @defer.inlineCallbacks
+    def test_usernames_batched(self):
+        self._http.expect(
+            'post',
+            'https://api.github.com/graphql',
+            json={
+                'query': 'query($u0: String!, $u1: String!) { '
+                'u0: user(login: $u0) { avatarUrl } u1: user(login: $u1) { avatarUrl } }',
+                'variables': {'u0': 'defunkt', 'u1': 'inexistent'},
+            },
+            content_json={
+                'data': {
+                    'u0': {'avatarUrl': 'https://avatars3.githubusercontent.com/u/42424242?v=4'},
+                    'u1': None,
+                },
+                'errors': [{'type': 'NOT_FOUND', 'path': ['u1']}],
+            },
+        )
+        d1 = self.render_resource(self.rsrc, b'/?username=defunkt')
+        d2 = self.render_resource(self.rsrc, b'/?username=inexistent')
+        d3 = self.render_resource(self.rsrc, b'/?username=DeFunkt&size=64')
+        self.reactor.advance(avatar.AvatarGitHub.batch_delay)
+
+        res = yield d1
+        self.assertEqual(
+            res, {"redirected": b'https://avatars3.githubusercontent.com/u/42424242?v=4&s=32'}
+        )
+        res = yield d2
+        self.assertEqual(res, {"redirected": b'img/nobody.png'})
+        res = yield d3
+        self.assertEqual(
+            res, {"redirected": b'https://avatars3.githubusercontent.com/u/42424242?v=4&s=64'}
+        )
+
+        # the user that was not found is not looked up again
+        res = yield self.render_resource(self.rsrc, b'/?username=inexistent&size=64')
+        self.assertEqual(res, {"redirected": b'img/nobody.png'})
+
+    @defer.inlineCallbacks
+    def test_batch_error(self):
+        self._http.expect(
+            'post',
+            'https://api.github.com/graphql',
+            json={
+                'query': 'query($u0: String!) { u0: user(login: $u0) { avatarUrl } }',
+                'variables': {'u0': 'defunkt'},
+            },
+            code=502,
+        )
+        d = self.render_resource(self.rsrc, b'/?username=defunkt')
+        self.reactor.advance(avatar.AvatarGitHub.batch_delay)
+        res = yield d
+        self.assertEqual(res, {"redirected": b'img/nobody.png'})
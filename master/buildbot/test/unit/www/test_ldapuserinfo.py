@@ -46,6 +46,8 @@ class FakeLdap:
             pass
 
         self.search = mock.Mock(spec=search)
+        self.closed = False
+        self.unbind = mock.Mock()
 
 
 class CommonTestCase(unittest.TestCase):
@@ -91,7 +93,7 @@ class CommonTestCase(unittest.TestCase):
             self.assertEqual(val[0][2], got[i][1]['attributes'])
 
 
-class LdapUserInfo(CommonTestCase):
+class LdapUserInfo(CommonTestCase, TestReactorMixin):
     def makeUserInfoProvider(self):
         self.userInfoProvider = ldapuserinfo.LdapUserInfo(
             uri="ldap://uri",
@@ -156,6 +158,16 @@ class LdapUserInfo(CommonTestCase):
             },
         )
 
+    @defer.inlineCallbacks
+    def test_updateUserInfoGroupsSingleValued(self):
+        self.makeSearchSideEffect([
+            [("cn", {"accountFullName": "me too", "accountEmail": "mee@too"})],
+            [("cn", {"groupName": "group"}), ("cn", {"groupName": ["group2", "group3"]})],
+            [],
+        ])
+        res = yield self.userInfoProvider.getUserInfo("me")
+        self.assertEqual(res['groups'], ["group", "group2", "group3"])
+
     @defer.inlineCallbacks
     def test_updateUserInfoGroupsUnicodeDn(self):
         # In case of non Ascii DN, ldap3 lib returns an UTF-8 str
@@ -181,6 +193,92 @@ class LdapUserInfo(CommonTestCase):
             },
         )
 
+    @defer.inlineCallbacks
+    def test_updateUserInfoReusesConnection(self):
+        self.userInfoProvider.connectLdap = mock.Mock(return_value=self.ldap)
+        self.makeSearchSideEffect([
+            [("cn", {"accountFullName": "me too", "accountEmail": "mee@too"})],
+            [],
+            [("cn", {"accountFullName": "me too", "accountEmail": "mee@too"})],
+            [],
+        ])
+        yield self.userInfoProvider.getUserInfo("me")
+        yield self.userInfoProvider.getUserInfo("you")
+        self.assertEqual(self.userInfoProvider.connectLdap.call_count, 1)
+        self.ldap.unbind.assert_not_called()
+
+    @defer.inlineCallbacks
+    def test_updateUserInfoDropsConnectionOnLdapError(self):
+        self.userInfoProvider.connectLdap = mock.Mock(return_value=self.ldap)
+        self.userInfoProvider.search.side_effect = ldap3.core.exceptions.LDAPException()
+        with self.assertRaises(ldap3.core.exceptions.LDAPException):
+            yield self.userInfoProvider.getUserInfo("me")
+        self.ldap.unbind.assert_called_once_with()
+
+        self.makeSearchSideEffect([
+            [("cn", {"accountFullName": "me too", "accountEmail": "mee@too"})],
+            [],
+        ])
+        yield self.userInfoProvider.getUserInfo("me")
+        self.assertEqual(self.userInfoProvider.connectLdap.call_count, 2)
+
+    @defer.inlineCallbacks
+    def test_updateUserInfoRetriesDroppedConnection(self):
+        self.userInfoProvider.connectLdap = mock.Mock(return_value=self.ldap)
+        self.makeSearchSideEffect([
+            [("cn", {"accountFullName": "me too", "accountEmail": "mee@too"})],
+            [],
+        ])
+        yield self.userInfoProvider.getUserInfo("me")
+
+        # the idle connection was dropped by the server
+        self.userInfoProvider.search.side_effect = [
+            ldap3.core.exceptions.LDAPSessionTerminatedByServerError(),
+            [{'dn': "cn", 'attributes': {"accountFullName": "you", "accountEmail": "you@too"}}],
+            [],
+        ]
+        res = yield self.userInfoProvider.getUserInfo("you")
+        self.assertEqual(res['full_name'], 'you')
+        self.ldap.unbind.assert_called_once_with()
+        self.assertEqual(self.userInfoProvider.connectLdap.call_count, 2)
+
+    @defer.inlineCallbacks
+    def test_updateUserInfoCached(self):
+        self.makeSearchSideEffect([
+            [("cn", {"accountFullName": "me too", "accountEmail": "mee@too"})],
+            [("cn", {"groupName": ["group"]})],
+        ])
+        res = yield self.userInfoProvider.getUserInfo("me")
+        res['email'] = 'modified@by.caller'
+        res['groups'].append('modified by the caller')
+        res = yield self.userInfoProvider.getUserInfo("me")
+        self.assertEqual(self.userInfoProvider.search.call_count, 2)
+        self.assertEqual(
+            res,
+            {'email': 'mee@too', 'full_name': 'me too', 'groups': ['group'], 'username': 'me'},
+        )
+
+    @defer.inlineCallbacks
+    def test_updateUserInfoCacheExpired(self):
+        self.setup_test_reactor()
+        self.userInfoProvider.master = mock.Mock(reactor=self.reactor)
+        self.makeSearchSideEffect([
+            [("cn", {"accountFullName": "me too", "accountEmail": "mee@too"})],
+            [],
+            [("cn", {"accountFullName": "me three", "accountEmail": "mee@three"})],
+            [],
+        ])
+        yield self.userInfoProvider.getUserInfo("me")
+        self.reactor.advance(self.userInfoProvider.userCacheTtl - 1)
+        res = yield self.userInfoProvider.getUserInfo("me")
+        self.assertEqual(self.userInfoProvider.search.call_count, 2)
+        self.assertEqual(res['full_name'], 'me too')
+
+        self.reactor.advance(1)
+        res = yield self.userInfoProvider.getUserInfo("me")
+        self.assertEqual(self.userInfoProvider.search.call_count, 4)
+        self.assertEqual(res['full_name'], 'me three')
+
 
 class LdapAvatar(CommonTestCase, TestReactorMixin, WwwTestMixin):
     @defer.inlineCallbacks
@@ -258,6 +356,17 @@ class LdapAvatar(CommonTestCase, TestReactorMixin, WwwTestMixin):
         ])
         self.assertRequest(contentType=mimeType, content=data)
 
+    @defer.inlineCallbacks
+    def test_getUsernameAvatarCached(self):
+        data = b'GIF8 lljklj'
+        self.makeRawSearchSideEffect([[("cn", {"picture": [data]})]])
+        yield self.render_resource(self.rsrc, b'/?username=me')
+        yield self.render_resource(self.rsrc, b'/?username=me&size=64')
+        self.assertSearchCalledWith([
+            (('accbase', 'accpattern=me', ['picture']), {}),
+        ])
+        self.assertRequest(contentType=b'image/gif', content=data)
+
     @defer.inlineCallbacks
     def test_getUnknownUsernameAvatar(self):
         self.makeSearchSideEffect([[], [], []])
@@ -227,8 +227,8 @@ class HTTPClientService(service.SharedService):
             kwargs['headers'] = {k: [v] for k, v in kwargs["headers"].items()}
 
         if session._treq_agent is None:
-            session._trex_agent = Agent(self.master.reactor, pool=self._pool)
-        kwargs['agent'] = session._trex_agent
+            session._treq_agent = Agent(self.master.reactor, pool=self._pool)
+        kwargs['agent'] = session._treq_agent
 
         res = yield getattr(treq, method)(url, **kwargs)
         return IHttpResponse(TreqResponseWrapper(res))
@@ -33,6 +33,8 @@ from buildbot.worker.protocols.manager.base import BaseManager
 from buildbot.worker.protocols.msgpack import Connection
 
 if TYPE_CHECKING:
+    from collections.abc import Callable
+
     from autobahn.websocket.types import ConnectionRequest
     from twisted.internet.defer import Deferred
     from twisted.internet.interfaces import IListeningPort
@@ -55,7 +57,7 @@ def decode_http_authorization_header(value: str) -> tuple[str, str]:
     if value[:5] != 'Basic':
         raise ValueError("Value should always start with 'Basic'")
 
-    credentials_str = base64.b64decode(value[6:]).decode()
+    credentials_str = base64.b64decode(value[6:], validate=True).decode()
     if ':' not in credentials_str:
         raise ValueError("String of credentials should always have a colon.")
 
@@ -79,6 +81,17 @@ class BuildbotWebSocketServerProtocol(WebSocketServerProtocol):
         self.connection: Connection | None = None
         self.worker_name: str | None = None
         self._deferwaiter = deferwaiter.DeferWaiter()
+        self._message_handlers: dict[str, Callable[[dict[str, Any]], Deferred[None]]] = {
+            "update": self.call_update,
+            "update_upload_file_write": self.call_update_upload_file_write,
+            "update_upload_file_close": self.call_update_upload_file_close,
+            "update_upload_file_utime": self.call_update_upload_file_utime,
+            "update_read_file": self.call_update_read_file,
+            "update_read_file_close": self.call_update_read_file_close,
+            "update_upload_directory_unpack": self.call_update_upload_directory_unpack,
+            "update_upload_directory_write": self.call_update_upload_directory_write,
+            "complete": self.call_complete,
+        }
 
     def get_dispatcher(self) -> Dispatcher:
         # This is an instance of class msgpack.Dispatcher set in Dispatcher.__init__().
@@ -156,12 +169,9 @@ class BuildbotWebSocketServerProtocol(WebSocketServerProtocol):
             command = self.command_id_to_command_map[msg['command_id']]
             yield command.remote_complete(msg['args'])
 
-            if msg['command_id'] in self.command_id_to_command_map:
-                del self.command_id_to_command_map[msg['command_id']]
-            if msg['command_id'] in self.command_id_to_reader_map:
-                del self.command_id_to_reader_map[msg['command_id']]
-            if msg['command_id'] in self.command_id_to_writer_map:
-                del self.command_id_to_writer_map[msg['command_id']]
+            self.command_id_to_command_map.pop(msg['command_id'], None)
+            self.command_id_to_reader_map.pop(msg['command_id'], None)
+            self.command_id_to_writer_map.pop(msg['command_id'], None)
         except Exception as e:
             is_exception = True
             result = str(e)
@@ -315,32 +325,16 @@ class BuildbotWebSocketServerProtocol(WebSocketServerProtocol):
             self.send_response_msg(msg, "Worker not authenticated.", is_exception=True)
             return
 
-        if msg['op'] == "update":
-            self._deferwaiter.add(self.call_update(msg))
-        elif msg['op'] == "update_upload_file_write":
-            self._deferwaiter.add(self.call_update_upload_file_write(msg))
-        elif msg['op'] == "update_upload_file_close":
-            self._deferwaiter.add(self.call_update_upload_file_close(msg))
-        elif msg['op'] == "update_upload_file_utime":
-            self._deferwaiter.add(self.call_update_upload_file_utime(msg))
-        elif msg['op'] == "update_read_file":
-            self._deferwaiter.add(self.call_update_read_file(msg))
-        elif msg['op'] == "update_read_file_close":
-            self._deferwaiter.add(self.call_update_read_file_close(msg))
-        elif msg['op'] == "update_upload_directory_unpack":
-            self._deferwaiter.add(self.call_update_upload_directory_unpack(msg))
-        elif msg['op'] == "update_upload_directory_write":
-            self._deferwaiter.add(self.call_update_upload_directory_write(msg))
-        elif msg['op'] == "complete":
-            self._deferwaiter.add(self.call_complete(msg))
+        handler = self._message_handlers.get(msg['op'])
+        if handler is not None:
+            self._deferwaiter.add(handler(msg))
         elif msg['op'] == "response":
-            seq_number = msg['seq_number']
+            # stop waiting for a response of this command
+            d = self.seq_num_to_waiters_map.pop(msg['seq_number'])
             if "is_exception" in msg:
-                self.seq_num_to_waiters_map[seq_number].errback(RemoteWorkerError(msg['result']))
+                d.errback(RemoteWorkerError(msg['result']))
             else:
-                self.seq_num_to_waiters_map[seq_number].callback(msg['result'])
-            # stop waiting for a response of this command
-            del self.seq_num_to_waiters_map[seq_number]
+                d.callback(msg['result'])
         else:
             self.send_response_msg(msg, f"Command {msg['op']} does not exist.", is_exception=True)
 
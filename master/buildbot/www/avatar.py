@@ -17,14 +17,16 @@ from __future__ import annotations
 
 import base64
 import hashlib
+import re
+from collections import OrderedDict
 from typing import TYPE_CHECKING
 from typing import Any
+from urllib.parse import quote_plus
 from urllib.parse import urlencode
 from urllib.parse import urljoin
-from urllib.parse import urlparse
-from urllib.parse import urlunparse
 
 from twisted.internet import defer
+from twisted.python import failure
 from twisted.python import log
 
 from buildbot import config
@@ -35,10 +37,25 @@ from buildbot.util.config import ConfiguredMixin
 from buildbot.www import resource
 
 if TYPE_CHECKING:
+    from twisted.internet.defer import Deferred
+    from twisted.internet.interfaces import IDelayedCall
+
     from buildbot.master import BuildMaster
     from buildbot.util.twisted import InlineCallbacksType
 
 
+# characters GitHub allows in logins; some old logins have leading, trailing or double hyphens
+_GITHUB_LOGIN_RE = re.compile(r'^[A-Za-z0-9-]+$')
+_GITHUB_LOGIN_MAX_LENGTH = 39
+# private commit emails generated by GitHub, which embed the login of the user
+_GITHUB_NOREPLY_EMAIL_RE = re.compile(
+    r'^(?:\d+\+)?([A-Za-z0-9-]+)@users\.noreply\.github\.com$', re.IGNORECASE
+)
+
+# query of the GitHub commit search, with its keys in sorted order
+_COMMIT_QUERY_TMPL = 'per_page=1&q={q}&sort=committer-date'
+
+
 class AvatarBase(ConfiguredMixin):
     name = "noavatar"
 
@@ -55,6 +72,15 @@ class AvatarGitHub(AvatarBase):
 
     DEFAULT_GITHUB_API_URL = 'https://api.github.com'
 
+    # for how many seconds a lookup that found nothing is not sent to GitHub again
+    negative_cache_ttl = 3600
+    # maximum number of lookups that found nothing which are remembered
+    negative_cache_max_size = 2048
+    # with batch_username_lookups, how long usernames are collected before they are looked up
+    batch_delay = 0.01
+    # with batch_username_lookups, maximum number of usernames looked up in one query
+    batch_max_size = 50
+
     client: httpclientservice.HTTPSession | None = None
 
     def __init__(
@@ -65,10 +91,17 @@ class AvatarGitHub(AvatarBase):
         client_secret: str | None = None,
         debug: bool = False,
         verify: bool = True,
+        batch_username_lookups: bool = False,
     ) -> None:
         self.github_api_endpoint = github_api_endpoint
         if github_api_endpoint is None:
             self.github_api_endpoint = self.DEFAULT_GITHUB_API_URL
+        # GitHub Enterprise serves the REST API under /api/v3 and GraphQL under /api/graphql
+        api_url = (github_api_endpoint or self.DEFAULT_GITHUB_API_URL).rstrip('/')
+        if api_url.endswith('/api/v3'):
+            self.graphql_url = api_url[: -len('v3')] + 'graphql'
+        else:
+            self.graphql_url = api_url + '/graphql'
         self.token = token
         self.client_creds = None
         if bool(client_id) != bool(client_secret):
@@ -80,11 +113,19 @@ class AvatarGitHub(AvatarBase):
             self.client_creds = base64.b64encode(
                 b':'.join(cred.encode('utf-8') for cred in (client_id, client_secret))  # type: ignore[union-attr]
             ).decode('ascii')
+        if batch_username_lookups and not token:
+            config.error('batch_username_lookups requires a token, as GraphQL needs one')
+        self.batch_username_lookups = batch_username_lookups
         self.debug = debug
         self.verify = verify
 
         self.master = None
         self.client = None
+        # (lookup kind, lowercased username or email) -> time the lookup found nothing
+        self._negative_cache: OrderedDict[tuple[str, str], float] = OrderedDict()
+        # lowercased username -> (username, Deferreds waiting for its avatar), for the next batch
+        self._pending_usernames: dict[str, tuple[str, list[Deferred[str | None]]]] = {}
+        self._batch_call: IDelayedCall | None = None
 
     @defer.inlineCallbacks
     def _get_http_client(self) -> InlineCallbacksType[httpclientservice.HTTPSession]:
@@ -111,17 +152,43 @@ class AvatarGitHub(AvatarBase):
 
         return self.client
 
+    def _is_known_missing(self, key: tuple[str, str]) -> bool:
+        assert self.master is not None
+        missed_at = self._negative_cache.get(key)
+        if missed_at is None:
+            return False
+        if self.master.reactor.seconds() - missed_at < self.negative_cache_ttl:
+            return True
+        del self._negative_cache[key]
+        return False
+
+    def _remember_missing(self, key: tuple[str, str]) -> None:
+        assert self.master is not None
+        self._negative_cache[key] = self.master.reactor.seconds()
+        self._negative_cache.move_to_end(key)
+        if len(self._negative_cache) > self.negative_cache_max_size:
+            self._negative_cache.popitem(last=False)
+
     @defer.inlineCallbacks
     def _get_avatar_by_username(self, username: str) -> InlineCallbacksType[str | None]:
         headers = {
             'Accept': 'application/vnd.github.v3+json',
         }
 
+        key = ('username', username.lower())
+        if self._is_known_missing(key):
+            return None
+
+        if self.batch_username_lookups:
+            avatar = yield self._queue_username_lookup(username)
+            return avatar
+
         url = f'/users/{username}'
         http = yield self._get_http_client()
         res = yield http.get(url, headers=headers)
         if res.code == 404:
             # Not found
+            self._remember_missing(key)
             return None
         if 200 <= res.code < 300:
             data = yield res.json()
@@ -130,12 +197,79 @@ class AvatarGitHub(AvatarBase):
         log.msg(f'Failed looking up user: response code {res.code}')
         return None
 
+    def _queue_username_lookup(self, username: str) -> Deferred[str | None]:
+        assert self.master is not None
+        d: Deferred[str | None] = defer.Deferred()
+        self._pending_usernames.setdefault(username.lower(), (username, []))[1].append(d)
+        if len(self._pending_usernames) >= self.batch_max_size:
+            if self._batch_call is not None:
+                self._batch_call.cancel()
+            self._flush_username_lookups()
+        elif self._batch_call is None:
+            self._batch_call = self.master.reactor.callLater(
+                self.batch_delay, self._flush_username_lookups
+            )
+        return d
+
+    @defer.inlineCallbacks
+    def _flush_username_lookups(self) -> InlineCallbacksType[None]:
+        self._batch_call = None
+        pending = self._pending_usernames
+        self._pending_usernames = {}
+        try:
+            avatars = yield self._get_avatars_by_usernames([u for u, _ in pending.values()])
+        except Exception:
+            f = failure.Failure()
+            for _, waiting in pending.values():
+                for d in waiting:
+                    d.errback(f)
+            return
+        for username, waiting in pending.values():
+            for d in waiting:
+                d.callback(avatars.get(username))
+
+    @defer.inlineCallbacks
+    def _get_avatars_by_usernames(
+        self, usernames: list[str]
+    ) -> InlineCallbacksType[dict[str, str | None]]:
+        # one aliased user() field per username, with the logins passed as variables
+        variables = {f'u{i}': username for i, username in enumerate(usernames)}
+        params = ', '.join(f'${alias}: String!' for alias in variables)
+        fields = ' '.join(f'{alias}: user(login: ${alias}) {{ avatarUrl }}' for alias in variables)
+        query = f'query({params}) {{ {fields} }}'
+
+        http = yield self._get_http_client()
+        res = yield http.post(self.graphql_url, json={'query': query, 'variables': variables})
+        if not 200 <= res.code < 300:
+            log.msg(f'Failed looking up users: response code {res.code}')
+            return {}
+
+        data = yield res.json()
+        users = data.get('data') or {}
+        not_found = {
+            error['path'][0]
+            for error in data.get('errors', [])
+            if error.get('type') == 'NOT_FOUND' and error.get('path')
+        }
+        avatars: dict[str, str | None] = {}
+        for alias, username in variables.items():
+            user = users.get(alias)
+            if user is not None:
+                avatars[username] = user['avatarUrl']
+            elif alias in not_found:
+                self._remember_missing(('username', username.lower()))
+        return avatars
+
     @defer.inlineCallbacks
     def _search_avatar_by_user_email(self, email: str) -> InlineCallbacksType[str | None]:
         headers = {
             'Accept': 'application/vnd.github.v3+json',
         }
 
+        key = ('email', email.lower())
+        if self._is_known_missing(key):
+            return None
+
         query = f'{email} in:email'
         url = f"/search/users?{urlencode({'q': query})}"
         http = yield self._get_http_client()
@@ -144,6 +278,7 @@ class AvatarGitHub(AvatarBase):
             data = yield res.json()
             if data['total_count'] == 0:
                 # Not found
+                self._remember_missing(key)
                 return None
             return data['items'][0]['avatar_url']
 
@@ -156,23 +291,24 @@ class AvatarGitHub(AvatarBase):
             'Accept': 'application/vnd.github.v3+json,application/vnd.github.cloak-preview',
         }
 
-        query = {
-            'q': f'author-email:{email}',
-            'sort': 'committer-date',
-            'per_page': '1',
-        }
-        sorted_query = sorted(query.items(), key=lambda x: x[0])
-        url = f'/search/commits?{urlencode(sorted_query)}'
+        key = ('commit', email.lower())
+        if self._is_known_missing(key):
+            return None
+
+        query = quote_plus(f'author-email:{email}')
+        url = f'/search/commits?{_COMMIT_QUERY_TMPL.format(q=query)}'
         http = yield self._get_http_client()
         res = yield http.get(url, headers=headers)
         if 200 <= res.code < 300:
             data = yield res.json()
             if data['total_count'] == 0:
                 # Not found
+                self._remember_missing(key)
                 return None
             author = data['items'][0]['author']
             if author is None:
                 # No Github account found
+                self._remember_missing(key)
                 return None
             return author['avatar_url']
 
@@ -180,19 +316,13 @@ class AvatarGitHub(AvatarBase):
         return None
 
     def _add_size_to_url(self, avatar: str, size: int) -> str:
-        parts = urlparse(avatar)
-        query = parts.query
-        if query:
-            query += '&'
-        query += f's={size}'
-        return urlunparse((
-            parts.scheme,
-            parts.netloc,
-            parts.path,
-            parts.params,
-            query,
-            parts.fragment,
-        ))
+        # avatar_url comes from GitHub and is well-formed, so there is no need to parse it
+        base, _, fragment = avatar.partition('#')
+        sep = '&' if '?' in base else '?'
+        url = f'{base}{sep}s={size}'
+        if fragment:
+            url += f'#{fragment}'
+        return url
 
     @defer.inlineCallbacks
     def getUserAvatar(
@@ -201,10 +331,22 @@ class AvatarGitHub(AvatarBase):
         username_str = username.decode('utf-8') if username else None
         email_str = email.decode('utf-8') if email else None
 
+        # do not spend API requests on lookups that cannot succeed
+        if username_str and (
+            len(username_str) > _GITHUB_LOGIN_MAX_LENGTH or not _GITHUB_LOGIN_RE.match(username_str)
+        ):
+            username_str = None
+        if email_str and '@' not in email_str[1:-1]:
+            email_str = None
+        noreply_email = _GITHUB_NOREPLY_EMAIL_RE.match(email_str) if email_str else None
+        if noreply_email and not username_str:
+            username_str = noreply_email.group(1)
+
         avatar: str | None = None
         if username_str:
             avatar = yield self._get_avatar_by_username(username_str)
-        if not avatar and email_str:
+        if not avatar and email_str and not noreply_email:
+            # private emails are never public in a profile
             avatar = yield self._search_avatar_by_user_email(email_str)
         if not avatar and email_str:
             # No luck, try to find a commit with this email
@@ -232,13 +374,11 @@ class AvatarGravatar(AvatarBase):
         # construct the url
         emailBytes = unicode2bytes(email.lower())
         emailHash = hashlib.md5(emailBytes)
-        gravatar_url = "//www.gravatar.com/avatar/"
+        gravatar_url = "https://www.gravatar.com/avatar/"
         gravatar_url += emailHash.hexdigest() + "?"
         if self.default != "url":
             defaultAvatarUrl = self.default
-        url = {'d': defaultAvatarUrl, 's': str(size)}
-        sorted_url = sorted(url.items(), key=lambda x: x[0])
-        gravatar_url += urlencode(sorted_url)
+        gravatar_url += f"d={quote_plus(defaultAvatarUrl)}&s={size}"
         raise resource.Redirect(gravatar_url)
 
 
@@ -247,16 +387,29 @@ class AvatarResource(resource.Resource):
     needsReconfig = True
     defaultAvatarUrl = b"img/nobody.png"
 
+    # maximum number of (email, username, size) lookups whose result is kept
+    cache_max_size = 2048
+    # for how many seconds browsers may reuse an avatar without asking again
+    browser_cache_max_age = 86400
+
     avatarMethods: list[AvatarBase] = []
     defaultAvatarFullUrl: bytes
-    cache: dict[tuple[bytes, bytes | None, int], Any]
+    defaultAvatarFullUrlStr: str
+    cache: OrderedDict[tuple[bytes, bytes | None, int], resource.Redirect]
+
+    def __init__(self, master: BuildMaster) -> None:
+        super().__init__(master)
+        # cache key -> Deferreds waiting for the lookup that is already running for that key
+        self._lookups: dict[tuple[bytes, bytes | None, int], list[Deferred[Any]]] = {}
 
     def reconfigResource(self, new_config: Any) -> None:
         avatar_methods = new_config.www.get('avatar_methods', [])
         self.defaultAvatarFullUrl = urljoin(
             unicode2bytes(new_config.buildbotURL), unicode2bytes(self.defaultAvatarUrl)
         )
-        self.cache = {}
+        # avatar methods take the URL as a string, decode it once per reconfig
+        self.defaultAvatarFullUrlStr = bytes2unicode(self.defaultAvatarFullUrl)
+        self.cache = OrderedDict()
 
         # ensure the avatarMethods is a iterable
         if isinstance(avatar_methods, AvatarBase):
@@ -279,20 +432,79 @@ class AvatarResource(resource.Resource):
         except ValueError:
             size = 32
         username = request.args.get(b"username", [None])[0]
-        cache_key = (email, username, size)
-        if self.cache.get(cache_key):
-            raise self.cache[cache_key]
+        # emails and usernames are matched case-insensitively by the avatar providers
+        cache_key = (email.strip().lower(), username.lower() if username else None, size)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            self.cache.move_to_end(cache_key)
+            self._set_cache_control(request, 'public')
+            raise cached.with_traceback(None)
+
+        waiting = self._lookups.get(cache_key)
+        if waiting is not None:
+            # the same avatar is already being looked up, share its result
+            d: Deferred[Any] = defer.Deferred()
+            waiting.append(d)
+            res = yield d
+        else:
+            waiting = self._lookups[cache_key] = []
+            try:
+                res = yield self._lookupAvatar(email, username, size, cache_key)
+            except Exception:
+                f = failure.Failure()
+                del self._lookups[cache_key]
+                for d in waiting:
+                    d.errback(f)
+                raise
+            del self._lookups[cache_key]
+            for d in waiting:
+                d.callback(res)
+
+        if res is None:
+            # no method knows the user, maybe only for now, so let browsers ask again
+            raise resource.Redirect(self.defaultAvatarUrl)
+        if isinstance(res, resource.Redirect):
+            self._set_cache_control(request, 'public')
+            raise res.with_traceback(None)
+        # the content may come from a directory that requires authentication,
+        # it must not be kept by shared caches
+        self._set_cache_control(request, 'private')
+        request.setHeader(b'content-type', res[0])
+        request.setHeader(b'content-length', unicode2bytes(str(len(res[1]))))
+        request.write(res[1])
+
+    def _set_cache_control(self, request: Any, scope: str) -> None:
+        request.setHeader(
+            b'cache-control', unicode2bytes(f'{scope}, max-age={self.browser_cache_max_age}')
+        )
+
+    @defer.inlineCallbacks
+    def _lookupAvatar(
+        self,
+        email: bytes,
+        username: bytes | None,
+        size: int,
+        cache_key: tuple[bytes, bytes | None, int],
+    ) -> InlineCallbacksType[Any]:
+        # returns the Redirect to raise, a (content type, content) tuple, or None when no
+        # method knows the user
         for method in self.avatarMethods:
             try:
                 res = yield method.getUserAvatar(
-                    email, username, size, bytes2unicode(self.defaultAvatarFullUrl)
+                    email, username, size, self.defaultAvatarFullUrlStr
                 )
             except resource.Redirect as r:
-                self.cache[cache_key] = r
-                raise
+                self._add_to_cache(cache_key, r)
+                return r
             if res is not None:
-                request.setHeader(b'content-type', res[0])
-                request.setHeader(b'content-length', unicode2bytes(str(len(res[1]))))
-                request.write(res[1])
-                return
-        raise resource.Redirect(self.defaultAvatarUrl)
+                return res
+        # not cached: no method may know the user only because of a transient error, the
+        # avatar methods remember by themselves the users they know they do not have
+        return None
+
+    def _add_to_cache(
+        self, cache_key: tuple[bytes, bytes | None, int], r: resource.Redirect
+    ) -> None:
+        self.cache[cache_key] = r
+        if len(self.cache) > self.cache_max_size:
+            self.cache.popitem(last=False)
@@ -59,23 +59,17 @@ class BaseHookHandler:
 
             Make sure to properly decode bytes to unicode strings.
             """
-            if isinstance(value, type([])):
+            if isinstance(value, list):
                 value = value[0]
             return bytes2unicode(value)
 
         args = cast(dict[bytes, list[bytes]], request.args)
         # first, convert files, links and properties
-        files = None
-        if args.get(b'files'):
-            files = json.loads(firstOrNothing(args.get(b'files')))
-        else:
-            files = []
-
-        properties = None
-        if args.get(b'properties'):
-            properties = json.loads(firstOrNothing(args.get(b'properties')))
-        else:
-            properties = {}
+        files_arg = args.get(b'files')
+        files = json.loads(firstOrNothing(files_arg)) if files_arg else []
+
+        properties_arg = args.get(b'properties')
+        properties = json.loads(firstOrNothing(properties_arg)) if properties_arg else {}
 
         revision = firstOrNothing(args.get(b'revision'))
         when: str | float | None = firstOrNothing(args.get(b'when_timestamp'))
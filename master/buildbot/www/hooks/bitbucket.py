@@ -28,6 +28,8 @@ from buildbot.util import bytes2unicode
 from buildbot.www.hooks.base import BaseHookHandler
 
 if TYPE_CHECKING:
+    from datetime import datetime
+
     from twisted.web.server import Request
 
 _HEADER_EVENT = b'X-Event-Key'
@@ -53,14 +55,20 @@ class BitBucketHandler(BaseHookHandler):
         repo_url = f"{payload['canon_url']}{payload['repository']['absolute_url']}"
         project = bytes2unicode(request.args.get(b'project', [b''])[0])
 
-        changes = []
+        # commits of a push often share their timestamp, parse each one only once
+        timestamps: dict[str, datetime] = {}
         for commit in payload['commits']:
-            changes.append({
+            utctimestamp = commit['utctimestamp']
+            if utctimestamp not in timestamps:
+                timestamps[utctimestamp] = dateparse(utctimestamp)
+
+        changes = [
+            {
                 'author': commit['raw_author'],
                 'files': [f['file'] for f in commit['files']],
                 'comments': commit['message'],
                 'revision': commit['raw_node'],
-                'when_timestamp': dateparse(commit['utctimestamp']),
+                'when_timestamp': timestamps[commit['utctimestamp']],
                 'branch': commit['branch'],
                 'revlink': f"{repo_url}commits/{commit['raw_node']}",
                 'repository': repo_url,
@@ -68,8 +76,11 @@ class BitBucketHandler(BaseHookHandler):
                 'properties': {
                     'event': event_type,
                 },
-            })
-            log.msg(f"New revision: {commit['node']}")
+            }
+            for commit in payload['commits']
+        ]
+        if changes:
+            log.msg(f"New revisions: {', '.join(commit['node'] for commit in payload['commits'])}")
 
         log.msg(f'Received {len(changes)} changes from bitbucket')
         return defer.succeed((changes, payload['repository']['scm']))
@@ -26,15 +26,20 @@
 
 from __future__ import annotations
 
+import copy
 import importlib
+import queue
+from collections import OrderedDict
+from typing import TYPE_CHECKING
 from typing import Any
+from typing import TypeVar
 from urllib.parse import urlparse
 
 from twisted.internet import defer
 from twisted.internet import threads
 
 from buildbot.util import bytes2unicode
-from buildbot.util import flatten
+from buildbot.util import now
 from buildbot.www import auth
 from buildbot.www import avatar
 
@@ -43,10 +48,30 @@ try:
 except ImportError:
     ldap3 = None
 
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+_T = TypeVar('_T')
+
+# first bytes of the supported avatar formats, of length 3 or 4
+# http://en.wikipedia.org/wiki/List_of_file_signatures
+_AVATAR_SIGNATURES = {
+    b"\xff\xd8\xff": b"image/jpeg",
+    b"\x89PNG": b"image/png",
+    b"GIF8": b"image/gif",
+}
+
 
 class LdapUserInfo(avatar.AvatarBase, auth.UserInfoProviderBase):
     name = 'ldap'
 
+    # maximum number of idle bound connections kept for reuse
+    connectionPoolSize = 8
+    # for how many seconds the user infos and avatars found in LDAP are reused
+    userCacheTtl = 300
+    # maximum number of cached user infos, and of cached avatars
+    userCacheMaxSize = 1024
+
     def __init__(
         self,
         uri: str,
@@ -92,6 +117,12 @@ class LdapUserInfo(avatar.AvatarBase, auth.UserInfoProviderBase):
         self.accountExtraFields = accountExtraFields
         self.ldap_encoding = ldap3.get_config_parameter('DEFAULT_SERVER_ENCODING')
         self.tls = tls
+        self._connections: queue.Queue[ldap3.Connection] = queue.Queue(
+            maxsize=self.connectionPoolSize
+        )
+        # key -> (time of the lookup, result), in least recently used order
+        self._userInfoCache: OrderedDict[str, tuple[float, dict[str, Any]]] = OrderedDict()
+        self._avatarCache: OrderedDict[tuple[str, str], tuple[float, Any]] = OrderedDict()
 
     def connectLdap(self) -> ldap3.Connection:
         server = urlparse(self.uri)
@@ -119,6 +150,73 @@ class LdapUserInfo(avatar.AvatarBase, auth.UserInfoProviderBase):
         )
         return c
 
+    def _now(self) -> float:
+        # master is only set when this is also an avatar method, the master reactor
+        # has the same clock as time.time() otherwise
+        return now(self.master.reactor if self.master is not None else None)
+
+    def _getCached(self, cache: OrderedDict[Any, tuple[float, Any]], key: Any) -> tuple[bool, Any]:
+        cached = cache.get(key)
+        if cached is None:
+            return False, None
+        if self._now() - cached[0] >= self.userCacheTtl:
+            del cache[key]
+            return False, None
+        cache.move_to_end(key)
+        return True, cached[1]
+
+    def _addToCache(self, cache: OrderedDict[Any, tuple[float, Any]], key: Any, value: Any) -> Any:
+        cache[key] = (self._now(), value)
+        cache.move_to_end(key)
+        if len(cache) > self.userCacheMaxSize:
+            cache.popitem(last=False)
+        return value
+
+    def _withConnection(self, fn: Callable[[ldap3.Connection], _T]) -> _T:
+        """Call fn with a bound connection, reusing an idle one when there is one.
+
+        Runs in the LDAP threads, hence the thread-safe queue.
+        """
+        c = self._takeIdleConnection()
+        if c is not None:
+            try:
+                return self._callWithConnection(fn, c)
+            except ldap3.core.exceptions.LDAPException:
+                # the server may have dropped the connection while it was idle,
+                # without it looking closed; try again once on a new one
+                pass
+        return self._callWithConnection(fn, self.connectLdap())
+
+    def _takeIdleConnection(self) -> ldap3.Connection | None:
+        while True:
+            try:
+                c = self._connections.get_nowait()
+            except queue.Empty:
+                return None
+            if not c.closed:
+                return c
+
+    def _callWithConnection(self, fn: Callable[[ldap3.Connection], _T], c: ldap3.Connection) -> _T:
+        try:
+            return fn(c)
+        except ldap3.core.exceptions.LDAPException:
+            # the connection may be in an unknown state, do not reuse it
+            self._closeConnection(c)
+            c = None
+            raise
+        finally:
+            if c is not None:
+                try:
+                    self._connections.put_nowait(c)
+                except queue.Full:
+                    self._closeConnection(c)
+
+    def _closeConnection(self, c: ldap3.Connection) -> None:
+        try:
+            c.unbind()
+        except Exception:
+            pass
+
     def search(
         self,
         c: ldap3.Connection,
@@ -131,9 +229,11 @@ class LdapUserInfo(avatar.AvatarBase, auth.UserInfoProviderBase):
 
     def getUserInfo(self, username: str) -> defer.Deferred:
         username = bytes2unicode(username)
+        found, infos = self._getCached(self._userInfoCache, username)
+        if found:
+            return defer.succeed(copy.deepcopy(infos))
 
-        def thd() -> dict[str, object]:
-            c = self.connectLdap()
+        def thd(c: ldap3.Connection) -> dict[str, object]:
             infos: dict[str, Any] = {'username': username}
             pattern = self.accountPattern % {"username": username}
             res = self.search(
@@ -164,39 +264,49 @@ class LdapUserInfo(avatar.AvatarBase, auth.UserInfoProviderBase):
             # needs double quoting of backslashing
             pattern = self.groupMemberPattern % {"dn": ldap3.utils.conv.escape_filter_chars(dn)}
             res = self.search(c, self.groupBase, pattern, attributes=[self.groupName])
-            infos['groups'] = flatten([
-                group_infos['attributes'][self.groupName] for group_infos in res
-            ])
+            groups: list[str] = []
+            for group_infos in res:
+                # single-valued attributes are not returned as lists
+                names = group_infos['attributes'][self.groupName]
+                if isinstance(names, list):
+                    groups.extend(names)
+                else:
+                    groups.append(names)
+            infos['groups'] = groups
 
             return infos
 
-        return threads.deferToThread(thd)
+        d = threads.deferToThread(self._withConnection, thd)
+        d.addCallback(
+            lambda infos: copy.deepcopy(self._addToCache(self._userInfoCache, username, infos))
+        )
+        return d
 
     def findAvatarMime(self, data: bytes) -> tuple[bytes, bytes] | None:
-        # http://en.wikipedia.org/wiki/List_of_file_signatures
-        if data.startswith(b"\xff\xd8\xff"):
-            return (b"image/jpeg", data)
-        if data.startswith(b"\x89PNG"):
-            return (b"image/png", data)
-        if data.startswith(b"GIF8"):
-            return (b"image/gif", data)
-        # ignore unknown image format
-        return None
+        mime = _AVATAR_SIGNATURES.get(data[:3]) or _AVATAR_SIGNATURES.get(data[:4])
+        if mime is None:
+            # ignore unknown image format
+            return None
+        return (mime, data)
 
     def getUserAvatar(
         self, email: bytes, username: bytes | None, size: int, defaultAvatarUrl: str
     ) -> defer.Deferred:
         username_str = bytes2unicode(username) if username is not None else None
         email_str = bytes2unicode(email) if email is not None else None
+        if username_str:
+            key = ('username', username_str)
+            pattern = self.accountPattern % {"username": username_str}
+        elif email_str:
+            key = ('email', email_str)
+            pattern = self.avatarPattern % {"email": email_str}  # type: ignore[operator]
+        else:
+            return defer.succeed(None)
+        found, avatar = self._getCached(self._avatarCache, key)
+        if found:
+            return defer.succeed(avatar)
 
-        def thd() -> tuple[bytes, bytes] | None:
-            c = self.connectLdap()
-            if username_str:
-                pattern = self.accountPattern % {"username": username_str}
-            elif email_str:
-                pattern = self.avatarPattern % {"email": email_str}  # type: ignore[operator]
-            else:
-                return None
+        def thd(c: ldap3.Connection) -> tuple[bytes, bytes] | None:
             res = self.search(c, self.accountBase, pattern, attributes=[self.avatarData])
             if not res:
                 return None
@@ -206,4 +316,6 @@ class LdapUserInfo(avatar.AvatarBase, auth.UserInfoProviderBase):
                 return self.findAvatarMime(data)
             return None
 
-        return threads.deferToThread(thd)
+        d = threads.deferToThread(self._withConnection, thd)
+        d.addCallback(lambda avatar: self._addToCache(self._avatarCache, key, avatar))
+        return d
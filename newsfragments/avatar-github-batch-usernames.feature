@@ -0,0 +1 @@
+``AvatarGitHub`` can now look up the avatars of several usernames with a single GitHub GraphQL query, with the new ``batch_username_lookups`` parameter